@@ -0,0 +1,80 @@
+# encoding: utf-8
+"""
+para_ok_or_400, perm_ok_or_403 每个请求的额外耗时, 与没有装饰的view比较
+itemset的大小从1到100
+"""
+from __future__ import unicode_literals
+
+from .common import per_call, record
+
+SIZES = (1, 5, 10, 25, 50, 100)
+QUICK_SIZES = (1, 10, 100)
+
+
+def _result_class():
+    from paraer import Result
+
+    class BenchResult(Result):
+        def response(self, status=200, serialize=False, **kwargs):
+            return status
+
+    return BenchResult
+
+
+def _allow(request, kwargs):
+    return True
+
+
+def _itemset(size):
+    return [dict(name='p%d' % x, method=int) for x in range(size)]
+
+
+def _view(para=0, perm=0):
+    from paraer import para_ok_or_400, perm_ok_or_403
+
+    def get(self, request, *args, **kwargs):
+        return kwargs
+
+    if para:
+        get = para_ok_or_400(_itemset(para))(get)
+    if perm:
+        get = perm_ok_or_403(
+            [dict(method=_allow, reason='denied')] * perm)(get)
+    return type(str('BenchView'), (object, ), dict(
+        get=get, result_class=_result_class()))()
+
+
+def _request(size):
+    from django.test import RequestFactory
+    from rest_framework.request import Request
+    query = {'p%d' % x: str(x) for x in range(size)}
+    return Request(RequestFactory().get('/', query))
+
+
+def run(quick=False):
+    sizes = QUICK_SIZES if quick else SIZES
+    number = 2000 if quick else 10000
+    results = []
+    request = _request(max(sizes))
+    plain = _view()
+    base = per_call(lambda: plain.get(request), number)
+    results.append(record('para.undecorated', base, 'us/call'))
+    for size in sizes:
+        view = _view(para=size)
+        assert view.get(request) != 400
+        value = per_call(lambda: view.get(request), number)
+        results.append(
+            record('para.para_ok_or_400.%d' % size, value, 'us/call',
+                   overhead=round(value - base, 3)))
+    for size in (1, 5):
+        view = _view(perm=size)
+        value = per_call(lambda: view.get(request), number)
+        results.append(
+            record('para.perm_ok_or_403.%d' % size, value, 'us/call',
+                   overhead=round(value - base, 3)))
+    view = _view(para=10, perm=3)
+    value = per_call(lambda: view.get(request), number)
+    results.append(
+        record('para.stacked.10x3', value, 'us/call',
+               overhead=round(value - base, 3)))
+    return results
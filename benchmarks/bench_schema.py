@@ -0,0 +1,66 @@
+# encoding: utf-8
+"""用合成的URLconf(10到2000个接口)生成swagger, 分别统计冷启动和命中缓存的耗时"""
+from __future__ import unicode_literals
+import time
+import types
+
+from .common import record
+
+SIZES = (10, 100, 500, 2000)
+QUICK_SIZES = (10, 100)
+
+
+def _endpoint(index):
+    from rest_framework.views import APIView
+    from paraer import para_ok_or_400
+
+    def get(self, request, *args, **kwargs):
+        """synthetic endpoint"""
+
+    itemset = [
+        dict(name='user_id', description={1: 'one', 2: 'two'}),
+        dict(name='start_date', msg='start date'),
+        dict(name='keyword', description=[('a', 'x'), ('b', 'y')]),
+    ]
+    get = para_ok_or_400(itemset)(get)
+    return type(str('Endpoint%d' % index), (APIView, ), dict(get=get))
+
+
+def urlconf(size):
+    from django.urls import path
+    module = types.ModuleType(str('bench_urls_%d' % size))
+    module.urlpatterns = [
+        path('app%d/endpoint%d/' % (x % 20, x), _endpoint(x).as_view())
+        for x in range(size)
+    ]
+    return module
+
+
+def _build(module):
+    from openapi_codec import encode
+    from rest_framework.schemas import SchemaGenerator
+    document = SchemaGenerator(
+        title='bench', urlconf=module).get_schema(
+            request=None, public=True)
+    return encode.generate_swagger_object(document)
+
+
+def run(quick=False):
+    from paraer.doc import registry, schema_cache
+    results = []
+    for size in QUICK_SIZES if quick else SIZES:
+        module = urlconf(size)
+        schema_cache.clear()
+        registry.clear()
+        start = time.time()
+        swagger = _build(module)
+        cold = time.time() - start
+        assert len(swagger['paths']) == size
+        start = time.time()
+        _build(module)
+        warm = time.time() - start
+        results.append(
+            record('schema.cold.%d' % size, cold * 1000, 'ms'))
+        results.append(
+            record('schema.cached.%d' % size, warm * 1000, 'ms'))
+    return results
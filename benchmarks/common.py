@@ -0,0 +1,43 @@
+# encoding: utf-8
+"""benchmark共用的django配置和计时工具, 不需要数据库和网络"""
+from __future__ import unicode_literals
+import timeit
+
+
+def setup():
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure(
+            DEBUG=False,
+            SECRET_KEY='benchmark',
+            ALLOWED_HOSTS=['*'],
+            INSTALLED_APPS=[
+                'django.contrib.contenttypes', 'django.contrib.auth',
+                'rest_framework'
+            ],
+            DATABASES={
+                'default': {
+                    'ENGINE': 'django.db.backends.sqlite3',
+                    'NAME': ':memory:'
+                }
+            },
+            ROOT_URLCONF=__name__,
+            REST_FRAMEWORK={
+                'DEFAULT_SCHEMA_CLASS': 'paraer.doc.SwaggerSchema',
+                'UNAUTHENTICATED_USER': None,
+            })
+    import django
+    django.setup()
+
+
+urlpatterns = []
+
+
+def per_call(func, number, repeat=5):
+    """func单次调用的耗时(微秒), 取repeat次中最快的一次"""
+    timer = timeit.Timer(func)
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def record(name, value, unit, **extra):
+    return dict(extra, name=name, value=round(value, 3), unit=unit)
@@ -0,0 +1,86 @@
+# encoding: utf-8
+"""
+比较导入paraer的耗时和加载的模块数:
+    lazy:  import paraer (不加载文档相关的模块)
+    eager: import paraer; paraer.patch_all() (之前import时的行为)
+每次都在新的解释器中执行, 输出json
+    python benchmarks/import_time.py [-n 10]
+"""
+from __future__ import print_function, unicode_literals
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SNIPPET = '''
+import sys, time, resource
+from django.conf import settings
+settings.configure(INSTALLED_APPS=['django.contrib.contenttypes',
+                                   'django.contrib.auth', 'rest_framework'])
+import django
+django.setup()
+before = set(sys.modules)
+start = time.time()
+import paraer
+%s
+elapsed = time.time() - start
+try:  # ru_maxrss在fork之后会包含父进程的内存, 优先用VmHWM
+    with open('/proc/self/status') as f:
+        rss = [x.split()[1] for x in f if x.startswith('VmHWM')][0]
+except (IOError, IndexError):
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(elapsed, len(set(sys.modules) - before), rss)
+'''
+
+CASES = {
+    'lazy': '',
+    'eager': 'paraer.patch_all()',
+}
+
+
+def run(case, number):
+    code = SNIPPET % CASES[case]
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    times, modules, rss = [], 0, 0
+    for _ in range(number):
+        output = subprocess.check_output(
+            [sys.executable, '-c', code], env=env).decode('utf-8')
+        elapsed, modules, rss = output.split()
+        times.append(float(elapsed))
+    times.sort()
+    return dict(
+        case=case,
+        median_ms=round(times[len(times) // 2] * 1000, 3),
+        min_ms=round(times[0] * 1000, 3),
+        modules=int(modules),
+        maxrss_kb=int(rss))
+
+
+def collect(number=10):
+    """benchmarks.run使用的格式"""
+    results = []
+    for case in sorted(CASES):
+        data = run(case, number)
+        results.append(
+            dict(
+                name='import.%s' % case,
+                value=data['median_ms'],
+                unit='ms',
+                modules=data['modules'],
+                maxrss_kb=data['maxrss_kb']))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number', type=int, default=10)
+    args = parser.parse_args()
+    results = [run(x, args.number) for x in sorted(CASES)]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# encoding: utf-8
+"""
+运行所有benchmark, 输出json, 并与保存的baseline比较
+    python -m benchmarks.run                      # 全部
+    python -m benchmarks.run --quick -o out.json  # 规模小一些, 结果写入out.json
+    python -m benchmarks.run --save-baseline      # 把本次结果保存为baseline
+比baseline慢超过tolerance的项会被标记为regression, 此时退出码为1
+baseline与机器有关, 应在同一台机器上生成和比较
+"""
+from __future__ import print_function, unicode_literals
+import argparse
+import json
+import os
+import platform
+import sys
+
+from .common import setup
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline.json')
+SUITES = ('para', 'schema', 'import')
+
+
+def collect(suites, quick):
+    setup()
+    results = []
+    if 'para' in suites:
+        from . import bench_para
+        results.extend(bench_para.run(quick))
+    if 'schema' in suites:
+        from . import bench_schema
+        results.extend(bench_schema.run(quick))
+    if 'import' in suites:
+        from . import import_time
+        results.extend(import_time.collect(3 if quick else 10))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """给每一项加上与baseline的比值, 返回regression的名称"""
+    base = {x['name']: x['value'] for x in baseline.get('results', ())}
+    regressions = []
+    for item in results:
+        value = base.get(item['name'])
+        if not value:
+            continue
+        item['baseline'] = value
+        item['ratio'] = round(item['value'] / value, 3)
+        if item['ratio'] > 1 + tolerance:
+            regressions.append(item['name'])
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='paraer benchmarks')
+    parser.add_argument('--suite', action='append', choices=SUITES)
+    parser.add_argument('--quick', action='store_true')
+    parser.add_argument('-o', '--output', help='write results to this file')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = collect(args.suite or SUITES, args.quick)
+    report = dict(
+        python=platform.python_version(),
+        machine=platform.machine(),
+        quick=args.quick,
+        results=results)
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare(results, json.load(f),
+                                            args.tolerance)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            f.write(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+    return 1 if report.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,18 @@
 __version__ = '0.0.31'
 
-from .datastrctures import Result, Valid, MethodProxy
-from .para import para_ok_or_400, perm_ok_or_403
+import django
+
+if django.VERSION < (3, 2):  # 3.2之后自动找到apps.py中的AppConfig, 设置了会有deprecation警告
+    default_app_config = 'paraer.apps.ParaerConfig'
+
+from .datastrctures import Result, Valid, MethodProxy, resolve
+from .loader import Lookup
+from .para import para_ok_or_400, perm_ok_or_403, guard
 from .fields import Field
-from .doc import patch_all
+from .cache import cacheable
+from .lazy import patch_all, install
 
 __all__ = ("Result", "MethodProxy", "Valid", "para_ok_or_400",
-           'perm_ok_or_403', 'Field')
-patch_all()
+           'perm_ok_or_403', 'Field', 'cacheable', 'Lookup', 'patch_all',
+           'resolve', 'guard')
+install()  # 用到文档时才patch, 见lazy.py
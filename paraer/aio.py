@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+para_ok_or_400, perm_ok_or_403 对协程视图的支持, 只在被装饰的视图是协程时导入(python3)
+错误的汇总与同步版本共用para中的_settle, 保证两者返回的result一致;
+同步的校验方法, 权限检查和before可能查询数据库, 用sync_to_async放到线程中执行, 不阻塞事件循环
+"""
+from __future__ import unicode_literals
+import asyncio
+from inspect import isawaitable, iscoroutinefunction
+from timeit import default_timer
+
+from asgiref.sync import sync_to_async
+
+from .datastrctures import scope, unscope
+from .para import (FAILED, ParaMap, _Errors, _invalid, _perm_name, _permit,
+                   _print_exc, _probe, _require, _run_steps, _settle, _skip,
+                   _stages, _validate_bulk)
+
+
+async def _measure(probe, name, awaitable, debug, failed, default=None):
+    start = default_timer()
+    value, error = default, None
+    try:
+        value = await awaitable
+    except Exception as e:
+        error = e
+        _print_exc(debug)
+    probe(name, default_timer() - start, error is not None or failed(value),
+          error)
+    return value
+
+
+async def _invoke(step, para):
+    """
+    与para._invoke相同; 并发的协程可能共用同一个Valid,
+    所以每次调用都有自己的scope
+    """
+    valid = step.valid
+    if valid is None:
+        return await step.call(para), 200, None
+    token = scope()
+    try:
+        return valid.outcome(await step.call(para))
+    finally:
+        unscope(token)
+
+
+async def _acall(step, para, debug, probe=None):
+    if probe is not None:
+        return await _measure(probe, step.name, _invoke(step, para), debug,
+                              lambda x: _invalid(x[0]), FAILED)
+    try:
+        return await _invoke(step, para)
+    except Exception:
+        _print_exc(debug)
+        return FAILED
+
+
+async def _apermit(item, perm, debug, probe=None):
+    if probe is not None:
+        return await _measure(probe, _perm_name(item), perm, debug,
+                              lambda x: not x)
+    try:
+        return await perm
+    except Exception:
+        _print_exc(debug)
+
+
+async def validate(plan, get, result, kwargs, debug, probe=None, limit=0):
+    """
+    与para._validate相同, 先执行同步的校验方法和Lookup(有查询数据库等的校验时一起在线程中执行),
+    异步的校验方法最后并发执行, 已有错误时昂贵的异步校验方法不再执行
+    """
+    token = scope()
+    try:
+        return await _validate(plan, get, result, kwargs, debug, probe, limit)
+    finally:
+        unscope(token)
+
+
+async def _validate(plan, get, result, kwargs, debug, probe, limit):
+    errors = _Errors(result)
+    paras = _require(plan, get, errors, limit)
+    pending, steps = [], []
+    for step, para in zip(plan, paras):
+        if para is None:
+            continue
+        if step.is_async and para:
+            pending.append((step, para))
+        else:
+            steps.append((step, para))
+    run = _run_steps
+    if any(x[0].blocking and x[1] for x in steps):  # orm只能同步调用
+        run = sync_to_async(_run_steps)
+    response = run(steps, errors, kwargs, debug, probe, limit)
+    if isawaitable(response):
+        response = await response
+    if response is not None:
+        return response
+    pending = [x for x in pending if not _skip(x[0], errors, limit)]
+    if pending:
+        outcomes = await asyncio.gather(*(_acall(step, para, debug, probe)
+                                          for step, para in pending))
+        for (step, para), outcome in zip(pending, outcomes):
+            if limit and errors.error_count >= limit:
+                break
+            errors.index = step.index
+            response = _settle(step, para, outcome, errors, kwargs, False)
+            if response is not None:
+                return response
+    errors.flush()
+
+
+def para_wrapper(func, plan, sources, settings, view, limit):
+    async def wrapper(cls, request, *args, **kwargs):
+        get = ParaMap(dict(kwargs), request, sources).get
+        result = cls.result_class()  # 继承与Result类
+        response = await validate(plan, get, result, kwargs, settings.DEBUG,
+                                  _probe(view, 'para'), limit)
+        if response is not None:
+            return response
+        if not result:
+            return result(status=400)
+        return await func(cls, request, *args, **kwargs)
+
+    return wrapper
+
+
+def bulk_wrapper(func, plan, sources, settings, bulk, view, limit):
+    async def wrapper(cls, request, *args, **kwargs):
+        result = cls.result_class()  # 继承与Result类
+        rows = []
+        response = await sync_to_async(_validate_bulk)(
+            plan, sources[-1](request), result, rows, settings.DEBUG,
+            _probe(view, 'para'), limit)
+        if response is not None:
+            return response
+        if not result:
+            return result(status=400)
+        kwargs[bulk] = rows
+        return await func(cls, request, *args, **kwargs)
+
+    return wrapper
+
+
+async def remember(perm, checked, key, stored, ttl):
+    """异步的权限检查完成后再记录结果, 抛出异常时不记录; stored为(cache, cache中的key)"""
+    perm = await perm
+    checked[key] = perm
+    if stored:
+        stored[0].set(stored[1], perm, ttl)
+    return perm
+
+
+async def _flush(checked, debug, probe=None):
+    """并发等待未完成的权限检查, 返回第一个不通过的item"""
+    pending = [(index, x) for index, x in enumerate(checked)
+               if isawaitable(x[1])]
+    if pending:
+        perms = await asyncio.gather(*(_apermit(x[0], x[1], debug, probe)
+                                       for _, x in pending))
+        for (index, _), perm in zip(pending, perms):
+            checked[index] = (checked[index][0], perm)
+    for item, perm in checked:
+        if not perm:
+            return item
+    del checked[:]
+
+
+async def _threaded(func, *args):
+    """在线程中执行同步的func, 返回值是awaitable时(如返回协程的lambda)再await"""
+    ret = await sync_to_async(func)(*args)
+    if isawaitable(ret):
+        ret = await ret
+    return ret
+
+
+async def denied(itemset, request, kwargs, debug, probe=None):
+    """返回第一个不通过的item, 有before的item会等前面的检查都完成后才执行"""
+    checked = []
+    for item in itemset:
+        before = item.get('before')
+        if before:
+            item_denied = await _flush(checked, debug, probe)
+            if item_denied is not None:
+                return item_denied
+            if iscoroutinefunction(before):
+                await before(request, kwargs)
+            else:
+                await _threaded(before, request, kwargs)
+        if iscoroutinefunction(item['method']):
+            perm = _permit(item, request, kwargs, debug, probe)
+        else:  # 耗时由_flush记录
+            perm = _threaded(_permit, item, request, kwargs, debug)
+        checked.append((item, perm))
+    return await _flush(checked, debug, probe)
+
+
+def perm_wrapper(func, itemset, settings, view):
+    async def wrapper(cls, request, *args, **kwargs):
+        item = await denied(itemset, request, kwargs, settings.DEBUG,
+                            _probe(view, 'perm'))
+        if item is not None:
+            return cls.result_class().perm(reason=item['reason'])(status=403)
+        return await func(cls, request, *args, **kwargs)
+
+    return wrapper
+
+
+def fused_wrapper(spec):
+    """para._fuse的异步版本"""
+    func, plan, sources, settings, view, limit = (
+        spec['func'], spec['plan'], spec['sources'], spec['settings'],
+        spec['view'], spec['limit'])
+    early, late = _stages(spec['perms'])
+
+    async def wrapper(cls, request, *args, **kwargs):
+        debug = settings.DEBUG
+        result = cls.result_class()  # 继承与Result类
+        probe = _probe(view, 'perm')
+        for itemset, _ in early:
+            item = await denied(itemset, request, kwargs, debug, probe)
+            if item is not None:
+                return result.perm(reason=item['reason'])(status=403)
+        get = ParaMap(dict(kwargs), request, sources).get  # before可能修改了kwargs
+        response = await validate(plan, get, result, kwargs, debug,
+                                  _probe(view, 'para'), limit)
+        if response is not None:
+            return response
+        if not result:
+            return result(status=400)
+        for itemset, _ in late:
+            item = await denied(itemset, request, kwargs, debug, probe)
+            if item is not None:
+                return result.perm(reason=item['reason'])(status=403)
+        return await func(cls, request, *args, **kwargs)
+
+    return wrapper
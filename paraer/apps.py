@@ -0,0 +1,13 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+from django.apps import AppConfig
+
+
+class ParaerConfig(AppConfig):
+    name = 'paraer'
+
+    def ready(self):
+        from django.conf import settings
+        if getattr(settings, 'PARAER_PATCH_ALL', False):
+            from .lazy import patch_all
+            patch_all()
@@ -0,0 +1,216 @@
+# encoding: utf-8
+"""
+不启动web服务, 离线生成swagger JSON和markdown文档, 如在CI中
+    python -m paraer.build --settings mysite.settings --out docs/ --jobs 8
+接口按url前缀(去掉公共前缀后的前depth段)分组, 由进程池分别生成schema, definitions和markdown,
+再按前缀的顺序合并, 结果与进程数无关; 最后输出各阶段的耗时
+"""
+from __future__ import print_function, unicode_literals
+import argparse
+import json
+import os
+import sys
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+from timeit import default_timer
+
+_state = {}  # 每个进程中的generator和接口
+
+
+def _setup(settings_module):
+    if settings_module:
+        os.environ['DJANGO_SETTINGS_MODULE'] = settings_module
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    from . import doc
+    doc.patch_all()
+
+
+def _generator(options, prefix=None):
+    from rest_framework.schemas import SchemaGenerator
+    generator = SchemaGenerator(
+        title=options['title'],
+        url=options['url'],
+        urlconf=options['urlconf'])
+    if prefix is not None:  # 与全部接口一起生成时的前缀相同, 保证key和tag不变
+        generator.determine_path_prefix = lambda paths: prefix
+    generator._initialise_endpoints()
+    return generator
+
+
+def _init(settings_module, options, prefix):
+    _setup(settings_module)
+    generator = _generator(options, prefix)
+    _state.update(
+        generator=generator, endpoints=generator.endpoints, options=options)
+
+
+def partition(generator, depth=1):
+    """返回(公共前缀, [(分组的前缀, 接口在generator.endpoints中的序号)])"""
+    paths, _ = generator._get_paths_and_endpoints(None)
+    if not paths:
+        return '', []
+    prefix = generator.determine_path_prefix(paths)
+    groups = OrderedDict()
+    for index, path in enumerate(paths):
+        key = '/'.join(path[len(prefix):].strip('/').split('/')[:depth])
+        groups.setdefault(key, []).append(index)
+    return prefix, sorted(groups.items())
+
+
+def _build(job):
+    """生成一组接口的paths, definitions和markdown, 返回结果和各阶段的耗时"""
+    from openapi_codec.encode import _get_links
+    from rest_framework.schemas import SchemaGenerator
+    from . import doc, utils
+    key, indexes = job
+    generator, endpoints = _state['generator'], _state['endpoints']
+    times = OrderedDict()
+    start = default_timer()
+    generator.endpoints = [endpoints[x] for x in indexes]
+    get_schema = getattr(SchemaGenerator.get_schema, '__paraer__',
+                         SchemaGenerator.get_schema)  # 不经过SchemaCache
+    document = get_schema(generator, request=None, public=True)
+    times['schema'] = default_timer() - start
+    if document is None:
+        return key, None, times
+    start = default_timer()
+    swagger = doc._generate_swagger_object(document)
+    links = _get_links(document)
+    times['swagger'] = default_timer() - start
+    start = default_timer()
+    swagger['definitions'] = doc.registry.collect(
+        x[1].__serializer__ for x in links
+        if getattr(x[1], '__serializer__', None))
+    times['definitions'] = default_timer() - start
+    sections = None
+    if utils.has_markdown:
+        from django.test import RequestFactory
+        start = default_timer()
+        factory = utils.MarkdownDocFactory([x[1] for x in links],
+                                           RequestFactory().get('/'), '')
+        sections = list(factory.iter_url_md())
+        times['markdown'] = default_timer() - start
+    return key, dict(swagger=swagger, sections=sections), times
+
+
+def merge(results):
+    """按前缀的顺序合并各组的结果, 返回(swagger, markdown的各部分)"""
+    from .doc import hoist_parameters
+    swagger, sections = None, []
+    paths, definitions = OrderedDict(), {}
+    for key, result, _ in sorted(results, key=lambda x: x[0]):
+        if result is None:
+            continue
+        part = result['swagger']
+        if swagger is None:
+            swagger = OrderedDict(
+                (x, y) for x, y in part.items()
+                if x not in ('paths', 'definitions'))
+        paths.update(part['paths'])
+        for name, definition in part['definitions'].items():
+            definitions.setdefault(name, definition)
+        sections.extend(result['sections'] or ())
+    if swagger is None:
+        return None, sections
+    swagger['paths'] = paths
+    swagger['definitions'] = OrderedDict(sorted(definitions.items()))
+    return hoist_parameters(swagger), sections
+
+
+def build(settings_module=None,
+          title='',
+          url=None,
+          urlconf=None,
+          out='.',
+          jobs=None,
+          depth=1,
+          swagger_name='swagger.json',
+          markdown_name='APIdoc.md'):
+    """生成文档, 返回写入的文件和各阶段的耗时"""
+    options = dict(title=title, url=url, urlconf=urlconf)
+    timings = OrderedDict()
+    start = default_timer()
+    _setup(settings_module)
+    generator = _generator(options)
+    prefix, groups = partition(generator, depth)
+    timings['partition'] = default_timer() - start
+
+    start = default_timer()
+    jobs = max(1, min(jobs or cpu_count(), len(groups) or 1))
+    groups.sort(key=lambda x: -len(x[1]))  # 大的组先开始
+    if jobs == 1:
+        _init(settings_module, options, prefix)
+        results = [_build(x) for x in groups]
+    else:
+        pool = Pool(jobs, _init, (settings_module, options, prefix))
+        try:
+            results = list(pool.imap_unordered(_build, groups))
+        finally:
+            pool.close()
+            pool.join()
+    timings['build'] = default_timer() - start
+    for _, _, times in results:  # 各进程中的耗时之和
+        for stage, value in times.items():
+            stage = 'build.%s' % stage
+            timings[stage] = timings.get(stage, 0) + value
+
+    start = default_timer()
+    swagger, sections = merge(results)
+    timings['merge'] = default_timer() - start
+
+    start = default_timer()
+    written = []
+    if not os.path.isdir(out):
+        os.makedirs(out)
+    if swagger is not None:
+        path = os.path.join(out, swagger_name)
+        with open(path, 'wb') as f:
+            f.write(
+                json.dumps(swagger, indent=2,
+                           ensure_ascii=False).encode('utf-8'))
+        written.append(path)
+    if sections:
+        path = os.path.join(out, markdown_name)
+        with open(path, 'wb') as f:
+            f.write(title.encode('utf-8'))
+            for section in sections:
+                f.write(section.encode('utf-8'))
+        written.append(path)
+    timings['write'] = default_timer() - start
+    return dict(
+        files=written, groups=len(groups), jobs=jobs, timings=timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='build swagger JSON and markdown docs offline')
+    parser.add_argument(
+        '--settings', help='Django settings module, '
+        'default DJANGO_SETTINGS_MODULE')
+    parser.add_argument('--urlconf')
+    parser.add_argument('--title', default='')
+    parser.add_argument('--url')
+    parser.add_argument('-o', '--out', default='.')
+    parser.add_argument('-j', '--jobs', type=int, help='default cpu count')
+    parser.add_argument(
+        '--depth', type=int, default=1, help='url segments per group')
+    parser.add_argument('--swagger', default='swagger.json')
+    parser.add_argument('--markdown', default='APIdoc.md')
+    args = parser.parse_args(argv)
+    sys.path.insert(0, os.getcwd())
+    report = build(args.settings, args.title, args.url, args.urlconf,
+                   args.out, args.jobs, args.depth, args.swagger,
+                   args.markdown)
+    for path in report['files']:
+        print('wrote %s' % path)
+    print('%s groups, %s jobs' % (report['groups'], report['jobs']))
+    for stage, value in report['timings'].items():
+        print('%-20s %8.1fms' % (stage, value * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
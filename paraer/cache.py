@@ -0,0 +1,253 @@
+# encoding: utf-8
+"""
+校验结果和权限检查结果的缓存
+    from paraer.cache import cacheable
+
+    class MyValid(Valid):
+        @cacheable(ttl=60, maxsize=2048)
+        def code(self, value):
+            return Code.objects.filter(code=value).exists()
+
+key由类名, 方法名, Valid的kwargs和参数值组成, 缓存的是(返回值, status, msg)
+"""
+from __future__ import unicode_literals
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from hashlib import md5
+
+MISSING = object()
+
+
+class BaseCache(object):
+    """
+    缓存后端, 子类实现_get, set, delete, clear, generation, bump; hits, misses为命中计数
+    generation(tag)为tag当前的代数, bump(tag)使其加一, 用来使一组key一起失效
+    """
+    shared = False  # 为True时在多个进程间共享, key必须在各进程中相同
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        value = self._get(key)
+        if value is MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def generation(self, tag):
+        raise NotImplementedError
+
+    def bump(self, tag):
+        raise NotImplementedError
+
+    def info(self):
+        return dict(hits=self.hits, misses=self.misses)
+
+
+class LRUCache(BaseCache):
+    """进程内的LRU缓存, 超过maxsize时淘汰最久未使用的, ttl(秒)为None时不过期"""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        super(LRUCache, self).__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._generations = {}  # 不参与淘汰, 以免代数回到0后旧的key又生效
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            item = self._data.get(key, MISSING)
+            if item is MISSING:
+                return MISSING
+            value, expires = item
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                return MISSING
+            self._data[key] = self._data.pop(key)  # 移到最后
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = ttl and time.time() + ttl or None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def generation(self, tag):
+        return self._generations.get(tag, 0)
+
+    def bump(self, tag):
+        with self._lock:
+            self._generations[tag] = self._generations.get(tag, 0) + 1
+
+    def __len__(self):
+        return len(self._data)
+
+    def info(self):
+        return dict(
+            super(LRUCache, self).info(),
+            size=len(self._data),
+            maxsize=self.maxsize)
+
+
+class DjangoCache(BaseCache):
+    """
+    使用django的cache框架, 可以在多个进程间共享; key会被转为字符串
+    代数也存在cache中, 所以clear和bump对所有进程生效, 每次get多一次cache读取
+    """
+    shared = True
+
+    def __init__(self, alias='default', prefix='paraer', ttl=None):
+        super(DjangoCache, self).__init__()
+        self.alias = alias
+        self.prefix = prefix
+        self.ttl = ttl
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def _key(self, key):
+        digest = md5(repr(key).encode('utf-8')).hexdigest()
+        return '%s:%s:%s' % (self.prefix, self.generation('*'), digest)
+
+    def _tag(self, tag):
+        return '%s:tag:%s' % (self.prefix, tag)
+
+    def _get(self, key):
+        return self.cache.get(self._key(key), MISSING)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.cache.set(self._key(key), value, ttl)
+
+    def delete(self, key):
+        self.cache.delete(self._key(key))
+
+    def clear(self):
+        self.bump('*')
+
+    def generation(self, tag):
+        return self.cache.get(self._tag(tag), 0)
+
+    def bump(self, tag):
+        key = self._tag(tag)
+        if self.cache.add(key, 1, None):
+            return
+        try:
+            self.cache.incr(key)
+        except ValueError:  # add之后被淘汰
+            self.cache.set(key, 1, None)
+
+
+def _freeze(data):
+    """
+    转为可hash的key, 每个值都带上类型, 使1和True, list和tuple等相等但类型不同的值不混淆;
+    有无法hash或无法排序的值时抛出TypeError
+    """
+    if isinstance(data, dict):
+        return (type(data),
+                tuple(sorted((x, _freeze(y)) for x, y in data.items())))
+    if isinstance(data, (set, frozenset)):
+        return (type(data), frozenset(_freeze(x) for x in data))
+    if isinstance(data, (list, tuple)):
+        return (type(data), tuple(_freeze(x) for x in data))
+    return (type(data), data)
+
+
+def cacheable(ttl=None, maxsize=1024, backend=None):
+    """
+    把Valid的方法声明为可缓存的, 只适用于结果只由参数值和kwargs决定的方法
+    backend默认为LRUCache(maxsize, ttl), 也可以传DjangoCache等BaseCache的实例
+    抛出异常的调用和无法hash的参数值不缓存
+    """
+
+    def decorator(method):
+        cache = LRUCache(maxsize, ttl) if backend is None else backend
+        prefix = '%s.%s' % (method.__module__, method.__name__)
+
+        @wraps(method)
+        def inner(self, value):
+            try:
+                key = (prefix, type(self).__name__, _freeze(self.kwargs),
+                       _freeze(value))
+                hash(key)
+            except TypeError:
+                return method(self, value)
+            cached = cache.get(key, MISSING)
+            if cached is not MISSING:
+                value, self.status, self.msg = cached
+                return value
+            result = method(self, value)
+            cache.set(key, (result, self.status, self.msg), ttl)
+            return result
+
+        inner.cache = cache
+        return inner
+
+    return decorator
+
+
+perm_cache = LRUCache(maxsize=4096)  # perm_ok_or_403默认的缓存
+
+
+def perm_key(method, key):
+    """同一个request中的检查结果以method本身区分, 同名的lambda和方法不会混淆"""
+    return ('perm', method, key)
+
+
+def _perm_tag(cache, method, name):
+    """进程内的cache以method本身区分; 共享的cache中method不能跨进程, 必须用稳定的name"""
+    if not cache.shared:
+        return method
+    if not name:
+        raise ValueError('%r: a stable name is required to cache '
+                         'perms in %s' % (method, type(cache).__name__))
+    return 'perm:%s' % name
+
+
+def perm_cache_key(cache, method, key, name=None):
+    """权限检查结果在cache中的key, 带有method的代数, 见invalidate_perm"""
+    tag = _perm_tag(cache, method, name)
+    return ('perm', tag, cache.generation(tag), key)
+
+
+def invalidate_perm(method, key=None, cache=None, name=None):
+    """
+    使权限检查的缓存失效, key为None时使该method的所有结果失效;
+    name与perm_ok_or_403的item中的name相同, 共享的cache(如DjangoCache)中必须提供
+    """
+    cache = perm_cache if cache is None else cache
+    if key is None:
+        cache.bump(_perm_tag(cache, method, name))
+    else:
+        cache.delete(perm_cache_key(cache, method, key, name))
@@ -0,0 +1,101 @@
+# encoding: utf-8
+"""
+按itemset中声明的type(或enum)直接转换参数的内置方法, 不经过Valid
+    @para_ok_or_400([
+        dict(name='user_id', type='integer'),  # 校验后为int
+        dict(name='start', type='date'),  # 校验后为datetime.date
+        dict(name='status', enum=('open', 'closed')),
+        dict(name='vendor'),  # 没有声明type, 不转换
+    ], coerce=True)
+只转换明确声明了type或enum的参数, 按参数名猜的type(如以id结尾为integer)只用于文档;
+转换失败时返回None(即校验失败), 不抛异常
+"""
+from __future__ import unicode_literals
+
+import re
+from datetime import date, datetime
+
+import six
+
+
+def coercer(func):
+    """标记为内置转换方法, para_ok_or_400不再把它包装为Valid"""
+    func.coercer = True
+    return func
+
+
+def is_coercer(method):
+    return getattr(method, 'coercer', False) is True
+
+
+_INTEGER = re.compile(r'[+-]?[0-9]+\Z')  # 不用\d, 它也匹配其他语言的数字
+
+
+@coercer
+def to_integer(value):
+    """整数, 值为整数的float(如1.0), 或只有ASCII数字(可带正负号)的字符串"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, six.string_types) and not _INTEGER.match(value):
+        return None
+    try:
+        number = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if isinstance(value, six.string_types) or number == value:
+        return number
+    return None  # 如1.7, 不截断
+
+
+if hasattr(date, 'fromisoformat'):
+    _parse_date = date.fromisoformat
+else:  # python2
+
+    def _parse_date(value):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+@coercer
+def to_date(value):
+    """只接受ISO格式: 2018-01-31"""
+    if isinstance(value, date):
+        return value
+    if not isinstance(value, six.string_types) or len(value) != 10:
+        return None
+    try:
+        return _parse_date(value)
+    except ValueError:
+        return None
+
+
+@coercer
+def to_string(value):
+    return True  # 直接取request中的值
+
+
+def choices(values):
+    """值必须在values中, 返回values中对应的值; request中的值为字符串时按字符串匹配"""
+    allowed = frozenset(values)
+    texts = {six.text_type(x): x for x in values}
+
+    @coercer
+    def choice(value):
+        try:
+            if value in allowed:
+                return True
+        except TypeError:  # unhashable
+            return None
+        return texts.get(value) if isinstance(value,
+                                              six.string_types) else None
+
+    return choice
+
+
+COERCERS = {'integer': to_integer, 'date': to_date, 'string': to_string}
+
+
+def resolve(item):
+    """按item中的enum或type返回转换方法, 没有对应的方法时返回None"""
+    if item.get('enum'):
+        return choices(item['enum'])
+    return COERCERS.get(item.get('type'))
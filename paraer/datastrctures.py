@@ -1,21 +1,58 @@
 # encoding: utf-8
 from __future__ import unicode_literals
+import copy
+import threading
+
+import six
+
+from .cache import LRUCache, _freeze
+
+try:
+    from contextvars import ContextVar
+except ImportError:  # python2 没有contextvars, 用threading.local
+
+    class ContextVar(threading.local):
+        def __init__(self, name, default=None):
+            self.value = default
+
+        def get(self):
+            return self.value
+
+        def set(self, value):
+            token, self.value = self.value, value
+            return token
+
+        def reset(self, token):
+            self.value = token
 
 
 class Result(object):
+    """
+    errors为dict的list, 可以直接append, extend或重新赋值
+    子类可以不定义__slots__
+    """
+    __slots__ = ('errors', 'serializer', 'dataset', 'msg')
+
     def __init__(self, dataset=None, serializer=None):
         self.errors = []
-        self._error = self.errors.append
         self.serializer = serializer
         self.dataset = None
         self.msg = None
 
+    @property
+    def _error(self):  # 兼容以前的属性, errors被重新赋值后仍然有效
+        return self.errors.append
+
+    @property
+    def error_count(self):
+        return len(self.errors)
+
     def data(self, dataset):
         self.dataset = dataset
         return self
 
     def error(self, key, value, **kwargs):
-        self._error(dict(kwargs, name=key, value=value))
+        self.errors.append(dict(kwargs, name=key, value=value))
         return self
 
     def perm(self, reason):
@@ -25,6 +62,8 @@ class Result(object):
     def __nonzero__(self):
         return not self.errors
 
+    __bool__ = __nonzero__
+
     def response(self):
         raise NotImplementedError
 
@@ -32,11 +71,57 @@ class Result(object):
         return self.response(status=status, serialize=serialize, **kwargs)
 
 
+_calls = ContextVar('paraer_calls', default=None)  # {id(valid): [status, msg]}
+
+
+def scope():
+    """
+    开始一次校验, 返回给unscope的token; 其间Valid设置的status, msg只记录在
+    当前线程/协程的这次校验中, 由Valid.outcome取出, 不会影响其他请求
+    """
+    return _calls.set({})
+
+
+def unscope(token):
+    _calls.reset(token)
+
+
+current = _calls.get  # 当前的scope, 不在scope中时为None
+
+
+def plain(valid):
+    """valid的类没有用property等覆盖status, msg时, 默认值在_status, _msg中"""
+    cls = type(valid)
+    return cls.status is _STATUS and cls.msg is _MSG
+
+
+class ValidType(type):
+    """
+    子类中 `msg = '...'` 这样的类属性会遮住Valid的status, msg property,
+    使self.msg = ...写到多个请求共用的实例上; 这里把它们改为_status, _msg的默认值,
+    设置的值仍然只属于这次调用. 子类用property等描述符覆盖时不做处理, 这样的实例也不共用(见intern)
+    """
+
+    def __new__(mcs, name, bases, attrs):
+        for key in ('status', 'msg'):
+            if key in attrs and not hasattr(attrs[key], '__get__'):
+                attrs['_' + key] = attrs.pop(key)
+        return super(ValidType, mcs).__new__(mcs, name, bases, attrs)
+
+
+@six.add_metaclass(ValidType)
 class Valid(object):
+    """
+    校验方法中可以像以前一样设置self.status, self.msg,
+    在scope中(para_ok_or_400校验时)设置的值只属于这次调用, 在scope之外设置的值为默认值
+    """
+    _status = 200
+    _msg = None
+
     def __init__(self, method, **kwargs):
         self.method = method
-        self.status = 200
-        self.msg = None
+        self._status = 200  # 与以前的self.status, self.msg相同, 覆盖类中的默认值
+        self._msg = None
         self.kwargs = kwargs
 
     def __str__(self):
@@ -45,8 +130,128 @@ class Valid(object):
     def __repr__(self):
         return '<Valid: %s>' % self.method
 
+    def _entry(self, state):
+        entry = state.get(id(self))
+        if entry is None:
+            entry = state[id(self)] = [self._status, self._msg]
+        return entry
+
+    @property
+    def status(self):
+        state = _calls.get()
+        entry = state.get(id(self)) if state else None
+        if entry is None:
+            return self._status
+        return entry[0]
+
+    @status.setter
+    def status(self, value):
+        state = _calls.get()
+        if state is None:
+            self._status = value
+        else:
+            self._entry(state)[0] = value
+
+    @property
+    def msg(self):
+        state = _calls.get()
+        entry = state.get(id(self)) if state else None
+        if entry is None:
+            return self._msg
+        return entry[1]
+
+    @msg.setter
+    def msg(self, value):
+        state = _calls.get()
+        if state is None:
+            self._msg = value
+        else:
+            self._entry(state)[1] = value
+
+    def outcome(self, value):
+        """取出这次调用中设置的status, msg, 返回(value, status, msg); 在scope中使用"""
+        state = _calls.get()
+        entry = state.pop(id(self), None) if state else None
+        if entry is not None:
+            return value, entry[0], entry[1]
+        return self.defaults(value)
+
+    def defaults(self, value):
+        """这次调用没有设置status, msg时, 返回(value, 默认的status, msg)"""
+        if plain(self):
+            return value, self._status, self._msg
+        return value, self.status, self.msg  # 子类覆盖了status或msg
+
+    def run(self, func, *args):
+        """在单独的scope中调用func, 返回(value, status, msg)"""
+        token = scope()
+        try:
+            return self.outcome(func(*args))
+        finally:
+            unscope(token)
+
     def __call__(self, *args, **kwargs):
-        return getattr(self, self.method)(*args, **kwargs)
+        return self.bind()(*args, **kwargs)
+
+    def bind(self):
+        """返回绑定后的目标方法, 只在第一次调用时getattr"""
+        bound = self.__dict__.get('_bound')
+        if bound is None:
+            bound = self._bound = getattr(self, self.method)
+        return bound
+
+    def many(self, values):
+        """
+        批量校验, 返回与values等长的list
+        子类可以定义 `<method>_many(values)` 来一次处理整列数据(如一次查询数据库)
+        """
+        batch = getattr(self, self.method + '_many', None)
+        if batch is not None:
+            return batch(values)
+        method = getattr(self, self.method)
+        return [method(x) for x in values]
+
+
+_STATUS = Valid.__dict__['status']
+_MSG = Valid.__dict__['msg']
+
+_interned = LRUCache(maxsize=4096)  # (valid_class, method, kwargs): Valid
+_intern_lock = threading.Lock()
+
+
+def intern(valid_class, method, kwargs):
+    """
+    同样的class, method和kwargs(值的类型也相同)共用一个Valid实例;
+    最多保留最近用到的4096个, 每个请求的kwargs都不同时不会无限增长;
+    子类自己实现了status, msg(不在scope中记录)时不共用
+    """
+    if valid_class.status is not _STATUS or valid_class.msg is not _MSG:
+        return valid_class(method, **kwargs)
+    try:
+        key = (valid_class, method, _freeze(kwargs))
+        hash(key)
+    except TypeError:  # kwargs中有无法hash的值
+        return valid_class(method, **kwargs)
+    valid = _interned.get(key)
+    if valid is None:
+        with _intern_lock:
+            valid = _interned.get(key)
+            if valid is None:
+                valid = valid_class(method, **kwargs)
+                _interned.set(key, valid)
+    return valid
+
+
+def resolve(itemset):
+    """
+    装饰前预先绑定itemset中所有Valid的方法, 方法不存在时抛出AttributeError,
+    para_ok_or_400在装饰时也会绑定, 但方法不存在时不报错
+    """
+    for item in itemset:
+        method = item.get('method')
+        if isinstance(method, Valid):
+            method.bind()
+    return itemset
 
 
 class MethodProxy(object):
@@ -56,8 +261,19 @@ class MethodProxy(object):
         self.valid_class = valid_class
 
     def __call__(self, *args, **kwargs):
-        self.kwargs = kwargs
-        return self
+        proxy = copy.copy(self)  # 不修改共用的proxy
+        proxy.kwargs = kwargs
+        return proxy
 
     def __getattr__(self, key):
-        return self.valid_class(key, **self.kwargs)
+        if key.startswith('__'):  # copy, pickle等
+            raise AttributeError(key)
+        return intern(self.valid_class, key, self.kwargs)
+
+    def cache_info(self):
+        """valid_class中被cacheable装饰的方法的命中情况"""
+        return {
+            x: getattr(self.valid_class, x).cache.info()
+            for x in dir(self.valid_class)
+            if hasattr(getattr(self.valid_class, x, None), 'cache')
+        }
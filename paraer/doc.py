@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals, print_function
+import gzip
+import json
 import re
+import threading
+from collections import OrderedDict
+from hashlib import md5
+from io import BytesIO
 
 from openapi_codec import encode
 from openapi_codec.encode import generate_swagger_object as _generate_swagger_object
@@ -9,7 +15,8 @@ from rest_framework.compat import coreapi
 from openapi_codec.encode import _get_links
 from django.db import models
 
-from .fields import _get_properties, _callback
+from .cache import LRUCache
+from .fields import get_properties, _callback
 
 RE_PATH = re.compile('\{(\w+)\}')  # extract  /{arg1}/{arg2}  to [arg1, arg2]
 
@@ -57,19 +64,235 @@ class SwaggerSchema(Schema):
 
 def wrap_generator(func):
     def inner(document):
+        swagger = getattr(document, '__swagger__', None)
+        if swagger is not None:  # document来自SchemaCache时只生成一次
+            return swagger
         swagger = _generate_swagger_object(document)
         links = _get_links(document)
-        result = {}
-        [
-            serializergeter(link[1].__serializer__, result) for link in links
-            if getattr(link[1], '__serializer__', None)
-        ]
-        swagger['definitions'] = result
+        swagger['definitions'] = registry.collect(
+            link[1].__serializer__ for link in links
+            if getattr(link[1], '__serializer__', None))
+        hoist_parameters(swagger)
+        document.__swagger__ = swagger
         return swagger
 
     return inner
 
 
+def _parameter_key(parameter):
+    return json.dumps(parameter, sort_keys=True)
+
+
+def hoist_parameters(swagger):
+    """
+    多个接口中相同的参数放到swagger['parameters']中, 接口中用$ref引用,
+    名称为 参数名_位置, 重名时加序号
+    """
+    operations = [
+        x for methods in swagger.get('paths', {}).values()
+        for x in methods.values() if isinstance(x, dict)
+    ]
+    counts = {}
+    for operation in operations:
+        for parameter in operation.get('parameters', ()):
+            key = _parameter_key(parameter)
+            counts[key] = counts.get(key, 0) + 1
+    shared = swagger.get('parameters') or OrderedDict()
+    names = {}
+    for operation in operations:
+        parameters = operation.get('parameters', ())
+        for index, parameter in enumerate(parameters):
+            if '$ref' in parameter:
+                continue
+            key = _parameter_key(parameter)
+            if counts[key] < 2:
+                continue
+            name = names.get(key)
+            if name is None:
+                base = '%s_%s' % (parameter.get('name'), parameter.get('in'))
+                name, number = base, 1
+                while name in shared:
+                    number += 1
+                    name = '%s_%s' % (base, number)
+                names[key] = name
+                shared[name] = parameter
+            parameters[index] = {'$ref': '#/parameters/%s' % name}
+    if shared:
+        swagger['parameters'] = shared
+    return swagger
+
+
+class SwaggerPayload(object):
+    """序列化好的swagger: JSON的bytes, gzip后的bytes, ETag"""
+    __slots__ = ('body', 'gzipped', 'etag')
+
+    def __init__(self, swagger):
+        self.body = json.dumps(
+            swagger, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        buf = BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as fp:
+            fp.write(self.body)
+        self.gzipped = buf.getvalue()
+        self.etag = '"%s"' % md5(self.body).hexdigest()
+
+
+def swagger_payload(document):
+    """document的SwaggerPayload, 与__swagger__一样只生成一次"""
+    payload = getattr(document, '__payload__', None)
+    if payload is None:
+        payload = SwaggerPayload(encode.generate_swagger_object(document))
+        document.__payload__ = payload
+    return payload
+
+
+def swagger_response(request, document):
+    """
+    返回document的swagger JSON, If-None-Match与ETag相同时返回304,
+    客户端支持gzip时返回gzip后的内容
+    """
+    from django.http import HttpResponse
+    from django.utils.cache import patch_vary_headers
+    from django.utils.http import parse_etags
+    payload = swagger_payload(document)
+    etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    if '*' in etags or payload.etag in {x.replace('W/', '', 1) for x in etags}:
+        response = HttpResponse(status=304)
+    elif 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = HttpResponse(
+            payload.gzipped, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(payload.body, content_type='application/json')
+    response['ETag'] = payload.etag
+    patch_vary_headers(response, ('Accept-Encoding', ))
+    return response
+
+
+def _api_request(request):
+    """非public时DRF按view的权限过滤接口, 需要带认证的rest_framework Request"""
+    from rest_framework.request import Request
+    from rest_framework.settings import api_settings
+    return Request(
+        request,
+        authenticators=[
+            x() for x in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+        ])
+
+
+def swagger_view(title='', url=None, urlconf=None, patterns=None, public=True):
+    """
+    提供swagger JSON的view, 如
+        url(r'^swagger.json$', swagger_view('API'))
+    schema由SchemaCache缓存, 接口不变时直接返回序列化好的内容
+    """
+    from rest_framework.schemas import SchemaGenerator
+    generator = SchemaGenerator(
+        title=title, url=url, urlconf=urlconf, patterns=patterns)
+
+    def view(request):
+        return swagger_response(
+            request,
+            generator.get_schema(
+                request=request if public else _api_request(request),
+                public=public))
+
+    return view
+
+
+_SWAGGER_KEYS = ('name', 'in', 'type', 'required', 'description')
+
+
+def fingerprint(generator):
+    """
+    根据URLconf中的接口和各个view上的__swagger__计算指纹, 比生成schema快得多
+    同时刷新generator.endpoints, 使URLconf变化后生成的schema也跟着变化
+    """
+    inspector = generator.endpoint_inspector_cls(generator.patterns,
+                                                 generator.urlconf)
+    endpoints = inspector.get_api_endpoints()
+    generator.endpoints = endpoints
+    digest = md5()
+    for path, method, callback in endpoints:
+        cls = getattr(callback, 'cls', None)
+        actions = getattr(callback, 'actions', None) or {}
+        action = actions.get(method.lower(), method.lower())
+        swagger = getattr(getattr(cls, action, None), '__swagger__', {})
+        parameters = tuple(
+            tuple(x.get(y) for y in _SWAGGER_KEYS)
+            for x in swagger.get('parameters', ()))
+        serializer = getattr(cls, 'serializer_class', None)
+        digest.update(
+            repr((path, method, cls and '%s.%s' % (cls.__module__,
+                                                  cls.__name__), action,
+                  swagger.get('title'), parameters, serializer
+                  and serializer.__name__)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class SchemaCache(object):
+    """
+    每个进程缓存生成好的schema, key为生成参数, 值为(指纹, document)
+    指纹变化时重新生成, 旧的document被替换; 最多缓存maxsize个, 超过时淘汰最久未使用的
+    """
+
+    def __init__(self, maxsize=128):
+        self._data = LRUCache(maxsize)
+
+    def key(self, generator, request, public):
+        url, user = generator.url, None
+        if request is not None:
+            if not url:  # DRF用请求的地址作为document.url, swagger中只用到scheme和host
+                url = request.build_absolute_uri('/')
+            if not public:  # 非public时不同用户看到的接口不同
+                user = getattr(getattr(request, 'user', None), 'pk', None)
+        return (generator.title, url, generator.urlconf,
+                id(generator.patterns), public, user)
+
+    def get(self, key, fingerprint):
+        cached = self._data.get(key)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+
+    def set(self, key, fingerprint, document):
+        self._data.set(key, (fingerprint, document))
+
+    def clear(self):
+        self._data.clear()
+
+
+schema_cache = SchemaCache()
+
+
+def cached_get_schema(func):
+    def get_schema(self, request=None, public=False):
+        key = schema_cache.key(self, request, public)
+        current = fingerprint(self)
+        document = schema_cache.get(key, current)
+        if document is None:
+            document = func(self, request=request, public=public)
+            document is not None and schema_cache.set(key, current, document)
+        return document
+
+    get_schema.__paraer__ = func
+    return get_schema
+
+
+def warm_schema(title='', url=None, urlconf=None, patterns=None):
+    """
+    启动时预先生成并缓存schema和swagger, 可以在AppConfig.ready中调用;
+    缓存的key中有url, url必须给出才能在请求时用上: swagger_view没有url时
+    为请求所用的scheme和host, 如 'https://api.example.com/', 否则与swagger_view的url相同
+    """
+    from rest_framework.schemas import SchemaGenerator
+    if not url:
+        raise ValueError('warm_schema needs the url of the swagger view')
+    patch_all()
+    generator = SchemaGenerator(
+        title=title, url=url, urlconf=urlconf, patterns=patterns)
+    document = generator.get_schema(request=None, public=True)
+    return encode.generate_swagger_object(document)
+
+
 def _get_serializer_name(serializer):
     if 'Serializer' in serializer.__name__:
         obj_name = serializer.__name__.split('Serializer')[0]
@@ -78,30 +301,94 @@ def _get_serializer_name(serializer):
     return obj_name
 
 
-def serializergeter(serializer, result):
-    obj_name = _get_serializer_name(serializer)
-    if obj_name in result:
-        return
-    result[obj_name] = None
+def _build_definition(serializer):
+    """
+    返回serializer(或model)的definition, 与它关联的model,
+    以及其中结构相同的部分拆出的definitions
+    """
+    model = None
     if issubclass(serializer, models.Model):
         model = serializer
     elif hasattr(serializer, 'Meta'):
-        if hasattr(serializer.Meta, 'model'):
-            model = serializer.Meta.model
-    else:  # set user model
+        model = getattr(serializer.Meta, 'model', None)
+    if model is None:  # set user model
         data = serializer().data
-        properties = _get_properties(data, [])
-        result[obj_name] = properties
-        return
+        definition, shared = get_properties(data,
+                                            _get_serializer_name(serializer))
+        return definition, (), shared
     fields = model._meta.get_fields()
-    for x in fields:
-        if getattr(x, 'remote_field', ''):
-            serializergeter(x.related_model, result)
+    related = tuple(x.related_model for x in fields
+                    if getattr(x, 'remote_field', ''))
+    properties = {x.name: _callback(x) for x in fields}
+    return dict(properties=properties, type='object'), related, {}
+
+
+class DefinitionRegistry(object):
+    """
+    进程内共用的definition注册表, 每个model或serializer类只生成一次
+    新的serializer在第一次用到时增量加入
+    """
+
+    def __init__(self):
+        self.names = {}  # class -> definition的名称
+        self.definitions = {}  # 名称 -> definition
+        self.depends = {}  # 名称 -> 关联的model的名称
+        self._lock = threading.RLock()
+
+    def register(self, serializer):
+        """迭代(非递归)地生成serializer及其关联的model的definition, 返回名称"""
+        name = self.names.get(serializer)
+        if name is not None:
+            return name
+        with self._lock:
+            stack = [serializer]
+            while stack:
+                current = stack.pop()
+                if current in self.names:
+                    continue
+                name = _get_serializer_name(current)
+                self.names[current] = name
+                if name in self.definitions:  # 同名的类只保留第一个
+                    continue
+                self.definitions[name] = None
+                try:
+                    definition, related, shared = _build_definition(current)
+                except Exception:  # 去掉这个类的记录, 下次生成时重试
+                    del self.names[current]
+                    del self.definitions[name]
+                    raise
+                for key, value in shared.items():
+                    self.definitions.setdefault(key, value)
+                self.definitions[name] = definition
+                self.depends[name] = tuple(
+                    _get_serializer_name(x) for x in related) + tuple(shared)
+                stack.extend(related)
+        return self.names[serializer]
+
+    def collect(self, serializers):
+        """返回serializers以及它们关联的所有definition"""
+        result = {}
+        stack = [self.register(x) for x in serializers]
+        while stack:
+            name = stack.pop()
+            if name in result:
+                continue
+            result[name] = self.definitions[name]
+            stack.extend(self.depends.get(name, ()))
+        return result
+
+    def clear(self):
+        with self._lock:
+            self.names.clear()
+            self.definitions.clear()
+            self.depends.clear()
+
+
+registry = DefinitionRegistry()
 
-    names = (x.name for x in fields)
-    properties = {x: _callback(y) for x, y in zip(names, fields)}
-    obj = dict(properties=properties, type='object')
-    result[obj_name] = obj
+
+def serializergeter(serializer, result):
+    result.update(registry.collect([serializer]))
 
 
 def _get200(link):
@@ -151,6 +438,13 @@ def _get_responses(link):
 
 def patch_all():
     import rest_framework
+    from rest_framework.schemas import SchemaGenerator
     rest_framework.schemas.AutoSchema = SwaggerSchema
     encode._get_responses = _get_responses
     encode.generate_swagger_object = wrap_generator(_generate_swagger_object)
+    if not hasattr(SchemaGenerator.get_schema, '__paraer__'):
+        SchemaGenerator.get_schema = cached_get_schema(
+            SchemaGenerator.get_schema)
+
+
+patch_all()  # 导入文档模块时即patch, 见lazy.py
@@ -1,21 +1,51 @@
 # encoding: utf-8
 from __future__ import unicode_literals, print_function
 
+import six
+
+_field_classes = {}  # 类型名称 -> Field的子类
+
+
+def field_class(name):
+    """每种类型的Field子类只生成一次, 如 integer -> IntegerField"""
+    cls = _field_classes.get(name)
+    if cls is None:
+        cls = _field_classes.setdefault(
+            name, type(str(name.capitalize() + 'Field'), (Field, ), {}))
+    return cls
+
 
 class Field(object):
+    """
+    描述返回值中的一个字段, name为类型名称(见MethodProxy), 如
+        Field('integer', description='用户id')
+    实例的类为该类型的Field子类, 不修改Field本身
+    """
+
+    def __new__(cls, name, *args, **kwargs):
+        if cls is Field:
+            cls = field_class(name)
+        return object.__new__(cls)
+
     def __init__(self, name, description=None, choices=None, format='string'):
         self.name = name
-        self.choices = None
+        self.choices = choices
         self.verbose_name = description
         self.format = format
-        self.__class__.__name__ = name.capitalize() + 'Field'
+
+
+_names = {}  # 字段的类 -> MethodProxy中的方法名
 
 
 def _namer(field):
-    field = field.__class__.__name__.lower().split('field')[0]
-    if field.endswith('serializer'):
-        return 'serializer'
-    return field
+    cls = field.__class__
+    name = _names.get(cls)
+    if name is None:
+        name = cls.__name__.lower().split('field')[0]
+        if name.endswith('serializer'):
+            name = 'serializer'
+        _names[cls] = name
+    return name
 
 
 class MethodProxy(object):
@@ -54,7 +84,7 @@ class MethodProxy(object):
     date = datetime
 
     def choice(self, field):
-        enum = field.choice_strings_to_values.keys()
+        enum = list(field.choice_strings_to_values.keys())
         return dict(type='string', enum=enum)
 
     def nestedserializer(self, field):
@@ -64,9 +94,17 @@ class MethodProxy(object):
         return dict(type='string', format='email')
 
     def primarykeyrelated(self, field):
-        return {'$ref': '#/definitions/{}'.format(key)}
+        queryset = getattr(field, 'queryset', None)
+        if queryset is None:
+            return dict(format='int64', type='integer')
+        return {
+            '$ref':
+            '#/definitions/{}'.format(queryset.model._meta.object_name)
+        }
 
-    serializer = primarykeyrelated
+    def serializer(self, field):
+        name = field.__class__.__name__
+        return {'$ref': '#/definitions/{}'.format(name.split('Serializer')[0])}
 
     def onetoone(self, field):
         return {
@@ -100,46 +138,114 @@ def _get_description(field):
 
 
 def _callback(field):
-    if field:
-        name = _namer(field)
+    name = _namer(field)
     if name == 'onetoonerel':
         field = field.remote_field
     data = getattr(proxy, name, proxy.text)(field)
     if name == 'manytomanyrel':
         field = field.remote_field
     data['description'] = _get_description(field)
-    if not isinstance(data['description'], str):
-        import ipdb; ipdb.set_trace(context=30)
-    if hasattr(field, 'choices') and field.choices:
-        data['enum'] = [x[0] for x in field.choices]
+    choices = getattr(field, 'choices', None)
+    if choices:
+        data['enum'] = [
+            x[0] if isinstance(x, (list, tuple)) else x for x in choices
+        ]
     return data
 
 
-def _get_properties(data, key=None):
-    result = {}
-    if isinstance(data, dict):
-        result = dict(type='object')
-        properties = {}
-        for key, value in data.items():
-            if isinstance(value, dict):
-                properties[key] = _get_properties(value)
-            elif isinstance(value, list):
-                properties[key] = dict(
-                    type='array', items=_get_properties(value))
+def _title(name):
+    return ''.join(x.capitalize() for x in six.text_type(name).split('_'))
+
+
+class Shapes(object):
+    """
+    把返回值的示例(dict, list, Field, 或作为类型名称的值)转为schema,
+    结构相同的嵌套dict/list只生成一次, 被多处引用的作为definition, 用$ref引用
+    """
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self.schemas = {}  # 结构 -> schema
+        self.children = {}  # 结构 -> [(位置, 子结构)]
+        self.names = {}  # 结构 -> 第一次出现时的key, 用于definition的名称
+
+    def leaf(self, value):
+        if isinstance(value, Field):
+            key = ('field', type(value), six.text_type(value.verbose_name),
+                   repr(value.choices))
+        else:
+            key = ('value', six.text_type(value))
+        schema = self.schemas.get(key)
+        if schema is None:
+            if not isinstance(value, Field):
+                value = Field(six.text_type(value), description=value)
+            schema = self.schemas[key] = _callback(value)
+        return key, schema
+
+    def node(self, value, name):
+        """返回(结构, schema), 相同结构的dict/list共用同一个schema"""
+        if isinstance(value, dict):
+            items = [(x, ) + self.get(y, x) for x, y in value.items()]
+            key = ('object', tuple(sorted((x, y) for x, y, _ in items)))
+        else:
+            items = [(x, ) + self.get(y, name) for x, y in enumerate(value)]
+            key = ('array', tuple(y for _, y, _ in items))
+        if key not in self.schemas:
+            self.names[key] = name
+            self.children[key] = [(x, y) for x, y, _ in items
+                                  if y in self.children]
+            if key[0] == 'object':
+                self.schemas[key] = dict(
+                    type='object', properties={x: z
+                                               for x, _, z in items})
             else:
-                if not isinstance(value, Field):
-                    field = Field(value, description=value)
-                properties[key] = _callback(field)
-        result['properties'] = properties
+                self.schemas[key] = dict(
+                    type='array', items=[z for _, _, z in items])
+        return key, self.schemas[key]
+
+    def get(self, value, name=None):
+        if isinstance(value, (dict, list)):
+            return self.node(value, name)
+        return self.leaf(value)
+
+    def build(self, data):
+        """返回(schema, definitions)"""
+        root, schema = self.get(data)
+        counts = {}
+        for children in self.children.values():
+            for _, key in children:
+                counts[key] = counts.get(key, 0) + 1
+        shared = {}  # 结构 -> definition的名称
+        used = set()
+        for key in self.children:
+            if counts.get(key, 0) > 1:
+                name = '%s%s' % (self.prefix, _title(self.names[key] or 'item'))
+                while name in used:
+                    name += '_'
+                used.add(name)
+                shared[key] = name
+        for key, children in self.children.items():
+            node = self.schemas[key]
+            slots = node['properties'] if key[0] == 'object' else node['items']
+            for slot, child in children:
+                if child in shared:
+                    slots[slot] = {'$ref': '#/definitions/%s' % shared[child]}
+        return schema, {y: self.schemas[x] for x, y in shared.items()}
+
+
+def get_properties(data, prefix=''):
+    """返回data的schema, 以及其中共用的definitions"""
+    if not isinstance(data, (dict, list)):
+        return {}, {}
+    schema, definitions = Shapes(prefix).build(data)
     if isinstance(data, list):
-        result = []
-        for value in data:
-            if isinstance(value, dict):
-                result.append(_get_properties(value))
-            elif isinstance(value, dict):
-                result.append(dict(type='array', items=_get_properties(value)))
-            else:
-                if not isinstance(value, Field):
-                    field = Field(value, description=value)
-                result.append(_callback(field))
-    return result
+        return schema['items'], definitions
+    return schema, definitions
+
+
+def _get_properties(data, key=None):
+    """只返回schema, 共用的部分不拆分为definitions"""
+    if not isinstance(data, (dict, list)):
+        return {}
+    root, schema = Shapes().get(data)
+    return schema['items'] if isinstance(data, list) else schema
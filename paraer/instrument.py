@@ -0,0 +1,96 @@
+# encoding: utf-8
+"""
+para_ok_or_400 和 perm_ok_or_403 的计时与计数
+默认的Instrument什么也不做(enabled为False时装饰器不计时), 可以换成MemoryInstrument:
+    from paraer import instrument
+    instrument.set_instrument(instrument.MemoryInstrument())
+    ...
+    instrument.active.dump()  # prometheus的文本格式
+也可以设置 PARAER_INSTRUMENT = 'path.to.instrument_instance'
+"""
+from __future__ import unicode_literals
+import threading
+
+
+class Instrument(object):
+    """
+    view为被装饰方法的全名, item为参数名或权限检查方法名
+    elapsed为耗时(秒), failed为是否校验失败(或无权限), error为抛出的异常
+    """
+    enabled = False
+
+    def para(self, view, item, elapsed, failed, error):
+        pass
+
+    def perm(self, view, item, elapsed, failed, error):
+        pass
+
+
+class MemoryInstrument(Instrument):
+    """在内存中按(kind, view, item)汇总调用次数, 失败次数, 异常次数和总耗时"""
+    enabled = True
+    metrics = ('calls', 'failures', 'exceptions', 'seconds')
+
+    def __init__(self):
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def _record(self, kind, view, item, elapsed, failed, error):
+        key = (kind, view, item)
+        with self._lock:
+            stat = self.stats.get(key)
+            if stat is None:
+                stat = self.stats[key] = [0, 0, 0, 0.0]
+            stat[0] += 1
+            stat[1] += bool(failed)
+            stat[2] += error is not None
+            stat[3] += elapsed
+
+    def para(self, view, item, elapsed, failed, error):
+        self._record('para', view, item, elapsed, failed, error)
+
+    def perm(self, view, item, elapsed, failed, error):
+        self._record('perm', view, item, elapsed, failed, error)
+
+    def reset(self):
+        with self._lock:
+            self.stats.clear()
+
+    def dump(self, prefix='paraer'):
+        """prometheus的文本格式"""
+        with self._lock:
+            stats = sorted(self.stats.items())
+        lines = []
+        for index, metric in enumerate(self.metrics):
+            name = '%s_%s_total' % (prefix, metric)
+            lines.append('# TYPE %s counter' % name)
+            for (kind, view, item), stat in stats:
+                lines.append('%s{kind="%s",view="%s",item="%s"} %s' %
+                             (name, kind, _escape(view), _escape(item),
+                              repr(stat[index])))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+active = Instrument()
+_configured = []
+
+
+def set_instrument(instrument):
+    global active
+    active = instrument or Instrument()
+
+
+def configure(settings):
+    """第一次装饰时读取settings.PARAER_INSTRUMENT"""
+    if _configured:
+        return
+    _configured.append(True)
+    path = getattr(settings, 'PARAER_INSTRUMENT', '')
+    if path:
+        from django.utils.module_loading import import_string
+        set_instrument(import_string(path))
@@ -0,0 +1,58 @@
+# encoding: utf-8
+"""
+延迟执行patch_all, 使只用到参数校验的进程(管理命令, celery worker等)不必导入文档相关的模块
+paraer.doc第一次被导入时(如DEFAULT_SCHEMA_CLASS为paraer.doc.SwaggerSchema)自动patch,
+openapi_codec(django-rest-swagger渲染文档时使用)被导入时也会导入paraer.doc,
+也可以设置 PARAER_PATCH_ALL = True 并把paraer加入INSTALLED_APPS, 在启动时patch
+"""
+from __future__ import unicode_literals
+import sys
+from importlib import import_module
+
+TRIGGER = 'openapi_codec'
+
+
+def patch_all():
+    from .doc import patch_all
+    patch_all()
+
+
+def load():
+    """导入paraer.doc, 第一次导入时会执行patch_all; 在paraer.doc导入过程中调用时什么也不做"""
+    import_module('paraer.doc')
+
+
+class PatchFinder(object):
+    """在TRIGGER模块执行完之后调用patch_all, 只生效一次"""
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname != TRIGGER:
+            return None
+        from importlib.util import find_spec
+        uninstall()
+        spec = find_spec(fullname)
+        if spec is None or spec.loader is None:
+            return spec
+        exec_module = spec.loader.exec_module
+
+        def exec_and_patch(module):
+            exec_module(module)
+            load()
+
+        spec.loader.exec_module = exec_and_patch
+        return spec
+
+
+finder = PatchFinder()
+
+
+def install():
+    if TRIGGER in sys.modules:  # 文档相关的模块已经加载, 直接patch
+        load()
+    elif sys.version_info[0] > 2 and finder not in sys.meta_path:
+        sys.meta_path.insert(0, finder)
+
+
+def uninstall():
+    if finder in sys.meta_path:
+        sys.meta_path.remove(finder)
@@ -0,0 +1,65 @@
+# encoding: utf-8
+"""
+按主键(或其他唯一字段)校验记录是否存在, 并把记录作为校验后的值
+    dict(name='user_id', method=Lookup(User))
+    dict(name='owner_id', method=Lookup(User), replace='owner')
+    dict(name='code', method=Lookup(Product, field='code'))
+同一个para_ok_or_400中对同一个model, field, queryset的Lookup会合并为一次 field__in 查询,
+批量模式下整列数据也只查询一次(Lookup.get_many)
+"""
+from __future__ import unicode_literals
+
+from .datastrctures import Valid
+
+
+class Lookup(Valid):
+    def __init__(self, model, field='pk', queryset=None, **kwargs):
+        super(Lookup, self).__init__('get', **kwargs)
+        self.model = model
+        self.field = field
+        self.queryset = queryset
+        self.group = (model, field, id(queryset))  # 可以合并查询的Lookup的key
+
+    def __repr__(self):
+        return '<Lookup: %s.%s>' % (self.model.__name__, self.field)
+
+    __str__ = __repr__
+
+    def get_queryset(self):
+        if self.queryset is not None:
+            return self.queryset.all()
+        return self.model._default_manager.all()
+
+    def _field(self):
+        meta = self.model._meta
+        return meta.pk if self.field == 'pk' else meta.get_field(self.field)
+
+    def to_python(self, value):
+        """转为字段的类型, 无法转换时返回None"""
+        from django.core.exceptions import ValidationError
+        try:
+            return self._field().to_python(value)
+        except (ValidationError, TypeError, ValueError):
+            return None
+
+    def fetch(self, values):
+        """一次查询, 返回 {字段值: 记录}"""
+        keys = {self.to_python(x) for x in values}
+        keys.discard(None)
+        if not keys:
+            return {}
+        attname = self._field().attname
+        queryset = self.get_queryset().filter(
+            **{'%s__in' % self.field: keys})
+        return {getattr(x, attname): x for x in queryset}
+
+    def pick(self, found, value):
+        key = self.to_python(value)
+        return None if key is None else found.get(key)
+
+    def get(self, value):
+        return self.pick(self.fetch([value]), value)
+
+    def get_many(self, values):
+        found = self.fetch(values)
+        return [self.pick(found, x) for x in values]
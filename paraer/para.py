@@ -1,14 +1,31 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, unicode_literals
 import six
-from functools import wraps
+import threading
+from functools import partial, wraps
+from itertools import chain
+try:
+    from inspect import iscoroutinefunction, isawaitable
+except ImportError:  # python2 没有协程
+
+    def iscoroutinefunction(func):
+        return False
+
+    def isawaitable(obj):
+        return False
+
+from timeit import default_timer
 from uuid import uuid1
+from django.http import QueryDict
 from django.utils.module_loading import import_string
 
-from .datastrctures import Valid
+from . import coercers, instrument
+from .datastrctures import Valid, current, plain, scope, unscope
+from .loader import Lookup
+from .cache import MISSING, _perm_tag, perm_cache, perm_cache_key, perm_key
 
 
-def _doc_generater(itemset, func):
+def _doc_generater(itemset, func, coerce=False):
     func_name = func.__name__
     locationmap = {
         'get': 'query',
@@ -30,13 +47,19 @@ def _doc_generater(itemset, func):
                 return 'date'
             return 'string'
 
+        item.setdefault('in_defaulted', 'in' not in item)  # 默认的位置不限制取值的位置
         item.setdefault('in', location)
         required = item['in'] == 'path'
-        item.setdefault('method', lambda x: x)
         item['name'] == 'pk' and item.update(
             name='id', type='integer', required=item.get('required', True))
         item.setdefault('required', required)
+        item.setdefault('type_defaulted', 'type' not in item)  # 按参数名猜的type只用于文档
         item.setdefault('type', type_by_name(item['name']))
+        if 'method' not in item and item.get('coerce', coerce) and (
+                item.get('enum') or not item['type_defaulted']):
+            item['method'] = coercers.resolve(item)  # 按声明的type转换, 不经过Valid
+        if item.get('method') is None:
+            item['method'] = lambda x: x
         description = item.get('description') or item.get(
             'msg') or 'description'
         msg = getattr(item['method'], 'msg',
@@ -55,7 +78,8 @@ def _doc_generater(itemset, func):
         item.setdefault('msg', msg)
         item.setdefault('replace', None)
         method = item['method']
-        if not isinstance(method, Valid):  # replace lambda as Valid
+        if not isinstance(method, Valid) and not coercers.is_coercer(
+                method):  # replace lambda as Valid
             name = str(uuid1()).split('-')[0]
             v = Valid(name)
             setattr(v, name, method)
@@ -77,114 +101,921 @@ def default_data_method(request):
     return request.GET or request.data
 
 
-def para_ok_or_400(itemset):
+def query_data_method(request):
+    return request.GET
+
+
+def body_data_method(request):
+    return request.data
+
+
+class ParaMap(object):
+    """
+    按需取参数: 先取url中的kwargs, 再依次取sources中的数据,
+    每个source只在第一次需要时才解析(如request.data), 没有用到就不解析
+    """
+    __slots__ = ('kwargs', 'request', 'sources', 'loaded')
+
+    def __init__(self, kwargs, request, sources):
+        self.kwargs = kwargs
+        self.request = request
+        self.sources = sources
+        self.loaded = [None] * len(sources)
+
+    def _source(self, index):
+        data = self.loaded[index]
+        if data is None:
+            data = self.loaded[index] = self.sources[index](self.request) or {}
+        return data
+
+    def get(self, name, default=None, where=None):
+        """where为要查找的sources的序号, 为None时查找所有的sources"""
+        kwargs = self.kwargs
+        if name in kwargs:
+            return kwargs[name]
+        if name == 'id' and kwargs.get('pk') is not None:
+            return kwargs['pk']  # Serializer fields中生成的为id 这个key， 但是django解析url中为 pk这个pk，为了不在文档中生成id 和pk这两个field， 所以都统一用id这个key， 那么在itemset中也写id这个key
+        loaded = self.loaded
+        for index in range(len(loaded)) if where is None else where:
+            data = loaded[index]
+            if data is None:
+                data = self._source(index)
+            if name in data:
+                if type(data) is QueryDict:  # 省去MultiValueDict.__getitem__, 同样取最后一个值
+                    value = dict.__getitem__(data, name)
+                    return value[-1] if value else []
+                return data[name]
+        return default
+
+
+def _where(item, sources):
+    """
+    item声明了in时只从对应的位置取值: path只取url中的kwargs, query只取querystring,
+    不会因为querystring中没有而去解析body; 返回sources的序号, None为全部
+    """
+    location = item.get('in')
+    if item.get('in_defaulted', True):
+        return None
+    if location == 'path':
+        return ()
+    if location in ('query', 'querystring') and query_data_method in sources:
+        return (sources.index(query_data_method), )
+    return None
+
+
+def _data_sources(settings, data_method=None, names=()):
+    """
+    data_method或PARAER_DATA_METHOD存在时只从它取数据, 否则先取querystring, 再取body
+    data_method.wants_names为True时, 调用时传入itemset中的参数名, 见stream.py
+    """
+    method = data_method or getattr(settings, 'PARAER_DATA_METHOD', '')
+    if not method:
+        return (query_data_method, body_data_method)
+    if isinstance(method, six.string_types):
+        method = import_string(method)  # 获取data的方法
+    if getattr(method, 'wants_names', False):
+        method = partial(method, names=tuple(names))
+    return (method, )
+
+
+EXPENSIVE = 10  # cost不小于它的校验方法在已有错误时不再执行
+TYPE_COSTS = {'integer': 1, 'date': 2, 'string': 2}
+
+
+def _cost(item):
+    """item中没有cost时, Valid子类的方法(一般要查数据库)为EXPENSIVE, 其余的按type确定"""
+    if 'cost' in item:
+        return item['cost']
+    if type(item['method']) is not Valid and not coercers.is_coercer(
+            item['method']):
+        return EXPENSIVE
+    return TYPE_COSTS.get(item.get('type'), 2)
+
+
+class _Step(object):
+    """itemset中单个参数编译后的校验步骤, 在装饰时生成, 请求时只读"""
+    __slots__ = ('name', 'valid', 'call', 'batch', 'required', 'msg', 'key',
+                 'is_async', 'index', 'cost', 'deferred', 'plain', 'blocking',
+                 'where')
+
+    def __init__(self, item, index=0, sources=()):
+        valid = item['method']  # Valid或内置的转换方法(见coercers)
+        self.index = index  # 在itemset中的位置, 用于按声明顺序输出错误
+        self.cost = _cost(item)
+        self.name = item['name']
+        # 只有Valid子类的方法会设置status, msg; 包装的函数和转换方法不需要scope
+        self.valid = None if _wrapped(valid) else valid
+        self.call = _bind(valid)
+        self.batch = getattr(valid, '%s_many' % getattr(valid, 'method', ''),
+                             None)  # 批量模式下一次处理整列数据的方法
+        self.required = item['required']
+        self.msg = item['msg']
+        self.key = item['replace'] or self.name  # 校验后写入kwargs的key
+        self.is_async = iscoroutinefunction(self.call)
+        self.deferred = isinstance(valid, Lookup)  # 与同一model的Lookup合并查询
+        self.plain = self.valid is not None and plain(valid)
+        # 可能查询数据库等的同步校验, 协程视图中放到线程中执行; 内置的转换方法除外
+        self.blocking = isinstance(valid, Valid) and not self.is_async
+        self.where = _where(item, sources)  # 取值的sources, 见_where
+
+
+def _wrapped(valid):
+    """不是Valid, 或是_doc_generater中包装普通函数的Valid(目标方法在实例上)"""
+    if not isinstance(valid, Valid):
+        return True
+    return type(valid) is Valid and valid.method in valid.__dict__
+
+
+def _bind(valid):
+    """直接绑定Valid的目标方法, 省去每次调用时的getattr"""
+    if isinstance(valid, Valid) and type(valid).__call__ is Valid.__call__:
+        try:
+            return valid.bind()
+        except AttributeError:
+            return valid
+    return valid
+
+
+def _compile(parameters, sources=()):
+    """按cost从小到大排列, cost相同时保持声明顺序"""
+    steps = (_Step(x, index, sources) for index, x in enumerate(parameters))
+    return tuple(sorted(steps, key=lambda x: (x.cost, x.index)))
+
+
+def _print_exc(debug):
+    if debug:
+        from traceback import print_exc
+        print_exc()
+
+
+def _invalid(value):
+    return value is None or value is False
+
+
+def _measure(probe, name, func, args, debug, failed, default=None):
+    """调用func并把耗时, 是否失败, 异常交给probe; 抛出异常时返回default"""
+    start = default_timer()
+    value, error = default, None
+    try:
+        value = func(*args)
+    except Exception as e:
+        error = e
+        _print_exc(debug)
+    probe(name, default_timer() - start, error is not None or failed(value),
+          error)
+    return value
+
+
+def _probe(view, kind):
+    """instrument开启时返回记录用的函数, 否则返回None"""
+    active = instrument.active
+    if active.enabled:
+        return partial(getattr(active, kind), view)
+
+
+def _view_name(func):
+    return '%s.%s' % (func.__module__,
+                      getattr(func, '__qualname__', func.__name__))
+
+
+FAILED = (None, 200, None)
+
+
+def _invoke(step, para):
+    """返回(value, status, msg), status, msg为Valid在这次调用中设置的值"""
+    valid = step.valid
+    if valid is None:
+        return step.call(para), 200, None
+    state = current()
+    if state is None:
+        return valid.run(step.call, para)
+    try:
+        value = step.call(para)
+    except Exception:
+        state and valid.outcome(None)  # 丢弃这次调用设置的status, msg
+        raise
+    if state:  # 这次调用设置了status或msg
+        return valid.outcome(value)
+    if step.plain:
+        return value, valid._status, valid._msg
+    return valid.defaults(value)
+
+
+def _call(step, para, debug, probe=None):
+    if probe is not None:
+        return _measure(probe, step.name, _invoke, (step, para), debug,
+                        lambda x: _invalid(x[0]), FAILED)
+    try:
+        if step.valid is None:  # 不需要scope, 省去一次函数调用
+            return step.call(para), 200, None
+        return _invoke(step, para)
+    except Exception:
+        _print_exc(debug)
+        return FAILED
+
+
+def _is_missing(step, para):
+    return step.required and para in (
+        None, '')  # 如果是post方法并且传参是json的话，para可能为0
+
+
+def _settle(step, para, outcome, result, kwargs, required=True):
+    """
+    把一个参数的校验结果(value, status, msg)汇总到result和kwargs中, 同步和异步共用;
+    403时返回响应
+    """
+    name = step.name
+    if required and _is_missing(step, para):
+        result.error(name, 'required')
+    if para is None:
+        return
+    value, status, msg = outcome
+    if para:
+        msg = msg or step.msg
+        if status == 403:  # 权限错误时直接返回错误
+            return result.perm(msg)(status=status)
+        if value is None or value is False:
+            result.error(name, msg)
+    if value is True:  # 当v返回的value为True时，取request中的值
+        value = para
+    kwargs[step.key] = value  # method 返回了非布尔值则更新kwargs
+
+
+class _Errors(object):
+    """
+    先记下错误, 最后按itemset中的声明顺序写入result,
+    使返回的错误顺序不受按cost排序后的执行顺序影响
+    """
+    __slots__ = ('result', 'errors', 'index')
+
+    def __init__(self, result):
+        self.result = result
+        self.errors = []
+        self.index = 0  # 当前step在itemset中的位置
+
+    def error(self, key, value, **kwargs):
+        self.errors.append((self.index, len(self.errors), key, value, kwargs))
+        return self
+
+    def perm(self, reason):
+        return self.result.perm(reason)
+
+    @property
+    def error_count(self):
+        return len(self.errors)
+
+    def flush(self):
+        error = self.result.error
+        for _, _, key, value, kwargs in sorted(self.errors):
+            error(key, value, **kwargs)
+
+
+def _require(plan, get, errors, limit=0):
+    """
+    先检查所有必填的参数, 返回与plan对应的参数值;
+    错误数达到limit时停止, 返回的参数值比plan短, 之后的校验也不再执行
+    """
+    paras = []
+    for step in plan:
+        para = get(step.name, None, step.where)
+        if step.required and para in (None, ''):  # 同_is_missing
+            errors.index = step.index
+            errors.error(step.name, 'required')
+            if limit and errors.error_count >= limit:
+                break
+        paras.append(para)
+    return paras
+
+
+def _skip(step, errors, limit):
+    """已有错误时跳过昂贵的校验, 错误数达到limit时停止"""
+    count = errors.error_count
+    return count and (step.cost >= EXPENSIVE or limit and count >= limit)
+
+
+def _load(deferred, debug, probe=None):
+    """按Lookup.group合并查询, 返回与deferred对应的记录"""
+    groups = {}
+    for index, (step, para) in enumerate(deferred):
+        groups.setdefault(step.valid.group, []).append(index)
+    values = [None] * len(deferred)
+    for indexes in groups.values():
+        lookup = deferred[indexes[0]][0].valid
+        paras = [deferred[x][1] for x in indexes]
+        if probe is not None:
+            name = '+'.join(deferred[x][0].name for x in indexes)
+            found = _measure(probe, name, lookup.fetch, (paras, ), debug,
+                             lambda x: len(x) < len(paras), {})
+        else:
+            try:
+                found = lookup.fetch(paras)
+            except Exception:
+                _print_exc(debug)
+                found = {}
+        for index, para in zip(indexes, paras):
+            values[index] = (lookup.pick(found, para), 200, None)
+    return values
+
+
+def _settle_deferred(deferred, outcomes, errors, kwargs, limit):
+    for (step, para), outcome in zip(deferred, outcomes):
+        if limit and errors.error_count >= limit:
+            return
+        errors.index = step.index
+        _settle(step, para, outcome, errors, kwargs, False)
+
+
+def _validate(plan, get, result, kwargs, debug, probe=None, limit=0):
+    """
+    同步的校验: 必填检查, 再按cost依次执行校验方法, Lookup最后合并查询;
+    403时返回响应
+    """
+    token = scope()  # 每个请求一次, 不必每次调用校验方法时设置
+    try:
+        return _validate_steps(plan, get, result, kwargs, debug, probe, limit)
+    finally:
+        unscope(token)
+
+
+def _validate_steps(plan, get, result, kwargs, debug, probe, limit):
+    errors = _Errors(result)
+    paras = _require(plan, get, errors, limit)
+    response = _run_steps([x for x in zip(plan, paras) if x[1] is not None],
+                          errors, kwargs, debug, probe, limit)
+    if response is None:
+        errors.flush()
+    return response
+
+
+def _run_steps(steps, errors, kwargs, debug, probe, limit):
+    """依次执行同步的校验方法, Lookup最后合并查询; steps为[(step, 参数值)]"""
+    deferred = []
+    failed = errors.errors  # 没有错误时不必检查_skip
+    for step, para in steps:
+        if failed and _skip(step, errors, limit):
+            if limit and errors.error_count >= limit:
+                break
+            continue
+        if step.deferred and para:
+            deferred.append((step, para))
+            continue
+        outcome = _call(step, para, debug,
+                        probe) if para else FAILED  # 与 '' 区别
+        errors.index = step.index
+        response = _settle(step, para, outcome, errors, kwargs, False)
+        if response is not None:
+            return response
+    deferred = [x for x in deferred if not _skip(x[0], errors, limit)]
+    if deferred:
+        _settle_deferred(deferred, _load(deferred, debug, probe), errors,
+                         kwargs, limit)
+
+
+class _Row(object):
+    """批量模式下给_settle用的result, 错误中带上行号"""
+    __slots__ = ('result', 'index')
+
+    def __init__(self, result, index):
+        self.result = result
+        self.index = index
+
+    def error(self, key, value):
+        return self.result.error(key, value, index=self.index)
+
+    def perm(self, reason):
+        return self.result.perm(reason)
+
+
+def _call_column(step, column, debug, probe=None):
+    """
+    对一列数据做校验, 返回每行的(value, status, msg);
+    校验方法支持批量时只调用一次, 其中设置的status, msg对整列有效
+    """
+    outcomes = [FAILED] * len(column)
+    indexes = [index for index, para in enumerate(column) if para]
+    if step.batch is None or not indexes:
+        for index in indexes:
+            outcomes[index] = _call(step, column[index], debug, probe)
+        return outcomes
+    paras = [column[x] for x in indexes]
+    failed = ((), 200, None)
+    if probe is not None:
+        batch = _measure(probe, step.name, step.valid.run,
+                         (step.batch, paras), debug,
+                         lambda x: any(_invalid(y) for y in x[0]), failed)
+    else:
+        try:
+            batch = step.valid.run(step.batch, paras)
+        except Exception:
+            _print_exc(debug)
+            batch = failed
+    values, status, msg = batch
+    for index, value in zip(indexes, values):
+        outcomes[index] = (value, status, msg)
+    return outcomes
+
+
+def _validate_bulk(plan,
+                   rows,
+                   result,
+                   validated,
+                   debug,
+                   probe=None,
+                   limit=0):
+    """按列校验body中的每一项, 校验后的每一项放到validated中; 403时返回响应"""
+    if not isinstance(rows, (list, tuple)):
+        result.error('data', 'list required')
+        return
+    validated.extend({} for _ in rows)
+    errors = _Errors(result)
+    token = scope()
+    try:
+        response = _validate_columns(plan, rows, errors, validated, debug,
+                                     probe, limit)
+    finally:
+        unscope(token)
+    if response is None:
+        errors.flush()
+    return response
+
+
+def _validate_columns(plan, rows, result, validated, debug, probe, limit):
+    """
+    按列校验; 已有错误的行不再执行昂贵的校验, 只检查必填, 其他行不受影响
+    """
+    failed = [False] * len(rows)  # 各行是否已有错误
+    for step in plan:
+        if limit and result.error_count >= limit:
+            return
+        result.index = step.index
+        name = step.name
+        column = [x.get(name) if isinstance(x, dict) else None for x in rows]
+        expensive = step.cost >= EXPENSIVE
+        active = [
+            x for x in range(len(rows)) if not (expensive and failed[x])
+        ]
+        outcomes = _call_column(step, [column[x] for x in active], debug,
+                                probe)
+        outcomes = dict(zip(active, outcomes))
+        for index, para in enumerate(column):
+            count = result.error_count
+            if index not in outcomes:
+                if _is_missing(step, para):
+                    _Row(result, index).error(name, 'required')
+            else:
+                response = _settle(step, para, outcomes[index],
+                                   _Row(result, index), validated[index])
+                if response is not None:
+                    return response
+            if result.error_count > count:
+                failed[index] = True
+                if limit and result.error_count >= limit:
+                    return
+
+
+def _limit(fail_fast, settings):
+    """fail_fast为True时遇到第一个错误就停止, 为整数n时遇到n个错误后停止"""
+    if fail_fast is None:
+        fail_fast = getattr(settings, 'PARAER_FAIL_FAST', False)
+    if fail_fast is True:
+        return 1
+    return int(fail_fast or 0)
+
+
+def _coerce(coerce, settings):
+    if coerce is None:
+        coerce = getattr(settings, 'PARAER_COERCE', False)
+    return bool(coerce)
+
+
+def para_ok_or_400(itemset,
+                   bulk=None,
+                   fail_fast=None,
+                   coerce=None,
+                   data_method=None):
     """
     验证参数值, 参数不对则返回400, 若参数正确则返回验证后的值, 并且根据itemset中的值，来生成func的__doc__
     name: 需要校验的参数名称
-    method: 校验方法, 校验成功时， 则返回校验方法后的校验值
+    method: 校验方法, 校验成功时， 则返回校验方法后的校验值, 可以是协程
     required: 是否可以为空
     msg: 校验失败返回的错误消息
     replace: 校验正确后返回的值对应的key
     description: 对参数的描述
     in: path, querystring, formData
     type: 参数类型(string, integer), 可以根据参数名称来确定, user_id(int), start_date(date), string
+    cost: 可选, 校验方法的开销, 先检查所有必填参数, 再按cost从小到大执行校验方法,
+          已有错误时不再执行cost不小于EXPENSIVE的校验方法; 错误仍按itemset的顺序返回
+          默认: Valid子类的方法为EXPENSIVE, 其余的按type, 见TYPE_COSTS
+    被装饰的func是协程时, wrapper也是协程, 其中的异步校验方法会并发执行
+
+    bulk: 批量模式, 值为kwargs中的key; body为list时对其中每一项按itemset校验,
+          校验方法会一次拿到整列数据(见Valid.many), 错误中带有行号index,
+          校验后的list放在kwargs[bulk]中
+    fail_fast: 为True时遇到第一个错误就返回400, 为整数n时遇到n个错误后返回400,
+               不再执行后面的校验方法; 默认为settings.PARAER_FAIL_FAST
+    coerce: 为True时没有method的参数按type(integer, date, string)或enum用内置方法转换,
+            见coercers; item中的coerce优先; 默认为settings.PARAER_COERCE
+    enum: 可选, 参数的可选值, coerce时校验值在其中
+    data_method: 获取参数的方法或其路径, 默认为settings.PARAER_DATA_METHOD,
+                 如只解析JSON body中用到的key的 paraer.stream.stream_data_method
     """
 
     def decorator(func):
         from django.conf import settings
-        swagger = _doc_generater(itemset, func)
-        data_method = default_data_method
-        if getattr(settings, 'PARAER_DATA_METHOD', ''):
-            data_method = import_string(settings.PARAER_DATA_METHOD)  # 获取data的方法
+        swagger = _doc_generater(itemset, func, _coerce(coerce, settings))
+        sources = _data_sources(settings, data_method,
+                                (x['name'] for x in swagger['parameters']))
+        plan = _compile(swagger['parameters'],
+                        sources)  # 装饰时编译, 请求时只遍历plan
+        instrument.configure(settings)
+        view = _view_name(func)
+        limit = _limit(fail_fast, settings)
+
+        if bulk and any(x.is_async for x in plan):
+            raise TypeError('bulk mode does not support async validator: %s'
+                            % func.__name__)
+        if bulk and iscoroutinefunction(func):
+            from .aio import bulk_wrapper
+            wrapper = bulk_wrapper(func, plan, sources, settings, bulk, view,
+                                   limit)
+        elif bulk:
+
+            def wrapper(cls, request, *args, **kwargs):
+                result = cls.result_class()  # 继承与Result类
+                rows = []
+                response = _validate_bulk(plan, sources[-1](request), result,
+                                          rows, settings.DEBUG,
+                                          _probe(view, 'para'), limit)
+                if response is not None:
+                    return response
+                if not result:
+                    return result(status=400)
+                kwargs[bulk] = rows
+                return func(cls, request, *args, **kwargs)
+
+        elif iscoroutinefunction(func):
+            from .aio import para_wrapper
+            wrapper = para_wrapper(func, plan, sources, settings, view, limit)
+            wrapper.__paraer__ = _spec(func, plan, sources, settings, view,
+                                       limit)
+        elif any(x.is_async for x in plan):
+            raise TypeError('async validator needs an async view: %s' %
+                            func.__name__)
+        else:
+
+            def wrapper(cls, request, *args, **kwargs):
+                get = ParaMap(dict(kwargs), request, sources).get
+                result = cls.result_class()  # 继承与Result类
+                response = _validate(plan, get, result, kwargs,
+                                     settings.DEBUG, _probe(view, 'para'),
+                                     limit)
+                if response is not None:
+                    return response
+                if not result:
+                    return result(status=400)
+                return func(cls, request, *args, **kwargs)
+
+            wrapper.__paraer__ = _spec(func, plan, sources, settings, view,
+                                       limit)
+
+        wrapper.__swagger__ = swagger
+        _copy_names(wrapper, func)
+        return wrapper
+
+    return decorator
+
+
+def _copy_names(wrapper, func):
+    wrapper.__name__ = func.__name__
+    wrapper.__qualname__ = getattr(func, '__qualname__', func.__name__)
+    wrapper.__module__ = func.__module__
+    wrapper.__doc__ = func.__doc__
+
+
+def _spec(func, plan, sources, settings, view, limit):
+    """para_ok_or_400编译好的各部分, 供perm_ok_or_403合并为一个wrapper, 见_fuse"""
+    return dict(
+        func=func,
+        plan=plan,
+        sources=sources,
+        settings=settings,
+        view=view,
+        limit=limit,
+        perms=())
+
+
+def _checked(request):
+    """当前request中已经做过的权限检查, 叠加的perm_ok_or_403共用"""
+    checked = getattr(request, '_paraer_perms', None)
+    if checked is None:
+        checked = {}
+        request._paraer_perms = checked
+    return checked
+
+
+def _perm_name(item):
+    method = item['method']
+    return item.get('name') or getattr(method, '__name__', repr(method))
+
+
+def _check(item, request, kwargs, debug, probe):
+    """执行权限检查, 抛出异常时返回MISSING; 异步的检查在aio中计时"""
+    method = item['method']
+    if probe is not None and not iscoroutinefunction(method):
+        return _measure(probe, _perm_name(item), method, (request, kwargs),
+                        debug, lambda x: not x, MISSING)
+    try:
+        return method(request, kwargs)
+    except Exception:
+        _print_exc(debug)
+        return MISSING
+
+
+def _sync_permit(item, request, kwargs, debug, probe=None):
+    """同步视图中的检查; 返回协程等awaitable时无法等待, 视为不通过"""
+    perm = _permit(item, request, kwargs, debug, probe)
+    if isawaitable(perm):
+        close = getattr(perm, 'close', None)
+        close and close()
+        return False
+    return perm
+
+
+def _perm_cache(item):
+    cache = item.get('cache')  # LRUCache为空时也是假值
+    return perm_cache if cache is None else cache
+
+
+def _permit(item, request, kwargs, debug, probe=None):
+    method = item['method']
+    keyer = item.get('key')
+    if keyer is None:
+        perm = _check(item, request, kwargs, debug, probe)
+        return None if perm is MISSING else perm
+    raw = keyer(request, kwargs)
+    key = perm_key(method, raw)
+    checked = _checked(request)
+    perm = checked.get(key, MISSING)
+    if perm is not MISSING:
+        return perm
+    ttl = item.get('ttl')
+    if ttl:
+        cache = _perm_cache(item)
+        cached = perm_cache_key(cache, method, raw, item.get('name'))
+        perm = cache.get(cached, MISSING)
+        if perm is not MISSING:
+            checked[key] = perm
+            return perm
+    perm = _check(item, request, kwargs, debug, probe)
+    if perm is MISSING:
+        return
+    if isawaitable(perm):
+        from .aio import remember
+        return remember(perm, checked, key, ttl and (cache, cached), ttl)
+    checked[key] = perm
+    ttl and cache.set(cached, perm, ttl)
+    return perm
+
+
+_pool = []  # perm_ok_or_403并发模式共用的线程池, 第一次使用时创建
+_pool_lock = threading.Lock()
+
+
+def _get_pool(settings):
+    if not _pool:
+        with _pool_lock:
+            if not _pool:
+                from concurrent.futures import ThreadPoolExecutor
+                size = getattr(settings, 'PARAER_PERM_POOL_SIZE', 8)
+                _pool.append(
+                    ThreadPoolExecutor(
+                        max_workers=size, thread_name_prefix='paraer-perm'))
+    return _pool[0]
+
+
+def _pooled_permit(item, request, kwargs, debug, probe=None):
+    """
+    线程池中执行的检查, 前后关闭该线程过期或出错的数据库连接, 与django处理请求时相同;
+    线程池中的连接与请求的连接不同, 看不到请求中(如ATOMIC_REQUESTS)未提交的修改
+    """
+    from django.db import close_old_connections
+    close_old_connections()
+    try:
+        return _sync_permit(item, request, kwargs, debug, probe)
+    finally:
+        close_old_connections()
+
+
+def _denied_parallel(pool, itemset, request, kwargs, debug, probe=None):
+    """
+    有before的item先依次执行, 其余的放到线程池中并发执行, 返回第一个不通过的item;
+    并发执行的检查使用各线程自己的数据库连接, 见_pooled_permit
+    """
+    from concurrent.futures import as_completed
+    rest = []
+    for item in itemset:
+        before = item.get('before')
+        if not before:
+            rest.append(item)
+            continue
+        before(request, kwargs)
+        if not _sync_permit(item, request, kwargs, debug, probe):
+            return item
+    futures = {
+        pool.submit(_pooled_permit, x, request, kwargs, debug, probe): x
+        for x in rest
+    }
+    for future in as_completed(futures):
+        if not future.result():
+            for x in futures:
+                x.cancel()  # 还没开始的不再执行, 正在执行的结果被忽略
+            return futures[future]
+
+
+def _denied(itemset, request, kwargs, debug, probe=None):
+    """依次检查, 返回第一个不通过的item"""
+    for item in itemset:
+        before = item.get('before')
+        before and before(request, kwargs)
+        if not _sync_permit(item, request, kwargs, debug, probe):
+            return item
+
+
+def _stages(perms):
+    """
+    把各层的权限检查分为校验参数之前和之后执行的两组, 各自保持原来的顺序;
+    item中validated为True时在校验之后执行, 使用校验后的kwargs
+    """
+    early, late = [], []
+    for itemset, parallel in perms:
+        pre = [x for x in itemset if not x.get('validated')]
+        post = [x for x in itemset if x.get('validated')]
+        pre and early.append((pre, parallel))
+        post and late.append((post, parallel))
+    return early, late
+
+
+def _denied_stage(stage, request, kwargs, settings, probe):
+    """依次检查各层, 返回第一个不通过的item"""
+    for itemset, parallel in stage:
+        if parallel:
+            item = _denied_parallel(
+                _get_pool(settings), itemset, request, kwargs, settings.DEBUG,
+                probe)
+        else:
+            item = _denied(itemset, request, kwargs, settings.DEBUG, probe)
+        if item is not None:
+            return item
+
+
+def _fuse(spec, func):
+    """
+    一个wrapper中: 先检查不需要校验后参数的权限, 再取参数并校验, 最后检查validated的权限;
+    没有权限时仍然先返回403, 不会执行校验(包括Lookup的查询), 400和403共用一个result_class实例
+    """
+    if iscoroutinefunction(spec['func']):
+        from .aio import fused_wrapper
+        wrapper = fused_wrapper(spec)
+    else:
+        target, plan, sources, settings, view, limit = (
+            spec['func'], spec['plan'], spec['sources'], spec['settings'],
+            spec['view'], spec['limit'])
+        early, late = _stages(spec['perms'])
 
         def wrapper(cls, request, *args, **kwargs):
-            paramap = dict(kwargs)
-            paramap.setdefault(
-                'id', kwargs.get('pk', None)
-            )  # Serializer fields中生成的为id 这个key， 但是django解析url中为 pk这个pk，为了不在文档中生成id 和pk这两个field， 所以都统一用id这个key， 那么在itemset中也写id这个key
-            data = data_method(request)
-            paramap.update({x: y for x, y in data.items()})
             result = cls.result_class()  # 继承与Result类
-            for item in itemset:
-                name, v, required, msg, replace = [
-                    item[x]
-                    for x in ['name', 'method', 'required', 'msg', 'replace']
-                ]
-                value = None  # 与 '' 区别
-                para = paramap.get(name)
-                if required and para in (None,
-                                         ''):  # 如果是post方法并且传参是json的话，para可能为0
-                    result.error(name, 'required')
-                if para is not None:
-                    if para:
-                        try:
-                            value = v(para)
-                        except Exception:
-                            if settings.DEBUG:
-                                from traceback import print_exc
-                                print_exc()
-                        msg = v.msg or msg
-                        if v.status == 403:  # 权限错误时直接返回错误
-                            return result.perm(name, msg)(status=v.status)
-                        if value is None or value is False:
-                            result.error(name, msg)
-                    if value is True:  # 当v返回的value为True时，取request中的值
-                        value = para
-                    kwargs.update({
-                        replace or name: value
-                    })  # method 返回了非布尔值则更新kwargs
+            probe = _probe(view, 'perm')
+            item = _denied_stage(early, request, kwargs, settings, probe)
+            if item is not None:
+                return result.perm(reason=item['reason'])(status=403)
+            get = ParaMap(dict(kwargs), request, sources).get  # before可能修改了kwargs
+            response = _validate(plan, get, result, kwargs, settings.DEBUG,
+                                 _probe(view, 'para'), limit)
+            if response is not None:
+                return response
             if not result:
                 return result(status=400)
-            return func(cls, request, *args, **kwargs)
+            item = _denied_stage(late, request, kwargs, settings, probe)
+            if item is not None:
+                return result.perm(reason=item['reason'])(status=403)
+            return target(cls, request, *args, **kwargs)
 
-        wrapper.__swagger__ = swagger
-        wrapper.__name__ = func.__name__
-        wrapper.__doc__ = func.__doc__
-        return wrapper
+    wrapper.__paraer__ = spec
+    wrapper.__swagger__ = getattr(func, '__swagger__', None)
+    _copy_names(wrapper, func)
+    return wrapper
+
+
+def _fusible(func, fuse, settings):
+    if fuse is None:
+        fuse = getattr(settings, 'PARAER_FUSE', False)
+    return fuse and getattr(func, '__paraer__', None) is not None
 
-    return decorator
 
+def perm_ok_or_403(itemset, parallel=False, fuse=None):
+    """
+    验证权限, 有一项不通过则返回403和该项的reason
+    before: 可选, 在method之前执行, 一般用来往kwargs中放数据
+    method: method(request, kwargs), 返回值为真则通过, 可以是协程
+    reason: 不通过时的原因
+    key: 可选, key(request, kwargs)返回可hash的值(如user id和相关的kwargs),
+         有key时同一个request中相同的检查只执行一次
+    ttl: 可选, 与key一起使用, 检查结果在cache中缓存ttl秒
+    cache: 可选, 缓存后端, 默认为paraer.cache.perm_cache, 可以用invalidate_perm使其失效
+    name: 可选, 检查的名字; cache为DjangoCache等共享的cache时必须提供, 作为cache中的key
+    validated: 可选, 合并(fuse)时为True的检查在参数校验之后执行, kwargs中为校验后的值;
+               其余的检查在校验之前执行, 与不合并时相同
+
+    parallel: 为True时, 有before的item先依次检查, 其余的在共用的线程池中并发检查,
+              第一个不通过的检查返回403, 线程池大小由settings.PARAER_PERM_POOL_SIZE设置(默认8);
+              并发的检查使用线程池中的数据库连接, 看不到请求中未提交的修改(如ATOMIC_REQUESTS时),
+              需要读这些数据的检查应放在有before的item中或不使用parallel
+    被装饰的func是协程时, 相邻的(中间没有before的)异步method会并发执行
 
-def perm_ok_or_403(itemset):
-    """验证参数值, 参数不对则返回400, 若参数正确则返回验证后的值"""
+    fuse: 为True时, 与下面的para_ok_or_400(非批量模式)合并为一个wrapper, 见_fuse,
+          只有validated的检查在校验参数之后执行, 其余的检查不通过时仍然先返回403;
+          默认为settings.PARAER_FUSE, 未设置时不合并
+    """
+    for item in itemset:
+        if item.get('key') and item.get('ttl'):  # 共享的cache没有name时尽早报错
+            _perm_tag(_perm_cache(item), item['method'], item.get('name'))
 
     def decorator(func):
+        from django.conf import settings
+        if not iscoroutinefunction(func) and any(
+                iscoroutinefunction(x['method'])
+                or iscoroutinefunction(x.get('before')) for x in itemset):
+            raise TypeError('async perm needs an async view: %s' %
+                            func.__name__)
+        instrument.configure(settings)
+        if _fusible(func, fuse, settings):
+            spec = func.__paraer__
+            return _fuse(
+                dict(spec, perms=((itemset, parallel), ) + spec['perms']),
+                func)
+        return _unfused(_perm_wrapper(func, itemset, parallel, settings))
+
+    return decorator
+
+
+def _unfused(wrapper):
+    """wraps会复制__paraer__, 去掉它以免外层把这一层合并掉"""
+    wrapper.__dict__.pop('__paraer__', None)
+    return wrapper
+
+
+def _perm_wrapper(func, itemset, parallel, settings):
+    view = _view_name(func)
+    if iscoroutinefunction(func):
+        from .aio import perm_wrapper
+        return wraps(func)(perm_wrapper(func, itemset, settings, view))
+
+    if parallel:
+
         @wraps(func)
         def wrapper(cls, request, *args, **kwargs):
-            for item in itemset:
-                before, method, reason = item.get('before'), item[
-                    'method'], item['reason']
-                before and before(request, kwargs)
-                try:
-                    perm = method(request, kwargs)
-                except Exception:
-                    perm = None
-                    if settings.DEBUG:
-                        from  traceback import print_exc
-                        print_exc()
-                if not perm:
-                    return cls.result_class().perm(reason=reason)(status=403)
+            item = _denied_parallel(
+                _get_pool(settings), itemset, request, kwargs, settings.DEBUG,
+                _probe(view, 'perm'))
+            if item is not None:
+                return cls.result_class().perm(
+                    reason=item['reason'])(status=403)
             return func(cls, request, *args, **kwargs)
 
         return wrapper
 
-    return decorator
+    @wraps(func)
+    def wrapper(cls, request, *args, **kwargs):
+        item = _denied(itemset, request, kwargs, settings.DEBUG,
+                       _probe(view, 'perm'))
+        if item is not None:
+            return cls.result_class().perm(reason=item['reason'])(status=403)
+        return func(cls, request, *args, **kwargs)
+
+    return wrapper
+
+
+def guard(params, perms, parallel=False, **options):
+    """
+    para_ok_or_400和perm_ok_or_403合并为一个wrapper:
+        @guard(params=[dict(name='user_id', type='integer')],
+               perms=[dict(method=..., reason='...', validated=True)])
+    validated的检查使用校验后的参数, 其余的在校验之前执行;
+    options为para_ok_or_400的其他参数; bulk时不能合并, 与分开装饰相同
+    """
 
+    def decorator(func):
+        return perm_ok_or_403(
+            perms, parallel, fuse=True)(para_ok_or_400(params,
+                                                       **options)(func))
 
-def _make(index, data, length):
-    if index == 0:
-        return ''.join([
-            join(data, length), '\n',
-            join(((x * '-') for x in length), length)
-        ])
-    return join(data, length)
+    return decorator
 
 
 def join(data, length):  # 填充空格
     try:
-        row = (''.join((x, (length[index] - len(x)) * ' '))
-               for index, x in enumerate(data))
-        row = '|'.join(row)
+        row = '|'.join(x + (length[index] - len(x)) * ' '
+                       for index, x in enumerate(data))
     except UnicodeDecodeError:
         print('UnicodeDecodeError!!!')
         print(data)
@@ -192,19 +1023,27 @@ def join(data, length):  # 填充空格
     return ''.join(('|', row, '|'))
 
 
+def _table(rows, length):
+    """rows的第一行为表头, 逐行生成后一次join"""
+    rows = iter(rows)
+    lines = [
+        join(next(rows), length),
+        join([x * '-' for x in length], length)
+    ]
+    lines.extend(join(data, length) for data in rows)
+    return '\n'.join(lines)
+
+
 def list2mk(dataset, title=None):
     if not dataset:
         return ''
     txt = ''  # 支持这种形式 ["description", [()]]
     if isinstance(dataset[0], six.string_types):
         txt = dataset[0]
-        dataset = dataset[1:]
-        dataset = [(str(x[0]), str(x[1])) for x in dataset]  # 为了把数字转为字符串
-    dataset = list(dataset)  # just shallow copy
-    title and dataset.insert(0, title)
-    length = [len(x) for x in dataset[0]]  # assert title is [str, str]
-    mk = '\n'.join(
-        _make(index, data, length) for index, data in enumerate(dataset))
+        dataset = [(str(x[0]), str(x[1]))
+                   for x in dataset[1:]]  # 为了把数字转为字符串
+    length = [len(x) for x in (title or dataset[0])]  # assert title is [str, str]
+    mk = _table(chain((title, ), dataset) if title else dataset, length)
     if txt:
         mk = '\n'.join((txt, '', mk))
     return mk
@@ -215,16 +1054,10 @@ def parse_description(dataset, title):
         isinstance(x, int) and str(x) or x: y
         for x, y in dataset.items()
     }  # 吧数字转为字符串
-    if isinstance(dataset, list):
-        return ''
     txt = dataset.pop('description', '')
     length = [max(map(len, x)) for x in [dataset, dataset.values()]]  # 取出最大长度
-
-    blank = join(((x * '-') for x in length), length)
     title = list(title.items())[0]
-    title = '\n'.join((join(title, length), blank))
-    mk = '\n'.join(join(data, length) for data in dataset.items())
-    mk = '\n'.join((title, mk))
+    mk = _table(chain((title, ), dataset.items()), length)
     if txt:
         mk = '\n'.join((txt, '\n', mk))
     return mk
@@ -0,0 +1,131 @@
+# encoding: utf-8
+"""
+只取itemset用到的顶层key的JSON data method, 适用于body很大但只校验少数几个参数的接口
+    PARAER_DATA_METHOD = 'paraer.stream.stream_data_method'
+或
+    @para_ok_or_400(itemset, data_method=stream_data_method)
+扫描request.body的bytes, 不需要的值只跳过, 不生成python对象, 扫描的时间与body的长度成线性;
+与json.loads一样重复的key以最后一个为准, 所以总是扫描到object结束;
+body仍然整个读入内存(见_raw_body), 节省的只是不需要的值解析成python对象的时间和内存;
+跳过很大的嵌套值时比json.loads慢; body不是JSON object(如批量模式的list)或格式错误时, 回到request.data
+"""
+from __future__ import unicode_literals
+
+import json
+import re
+from io import BytesIO
+
+_WS = re.compile(br'[ \t\n\r]*')
+_STRING = re.compile(br'"[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+_SCALAR = re.compile(br'[^,}\] \t\n\r]+')  # 数字, true, false, null
+_SPECIAL = re.compile(br'["\[\]{}]')  # 嵌套值中的字符串和括号
+_DEPTH = {b'{': 1, b'[': 1, b'}': -1, b']': -1}
+
+
+def _skip(raw, pos):
+    """返回从pos开始的JSON值的结束位置"""
+    head = raw[pos:pos + 1]
+    if head == b'"':
+        match = _STRING.match(raw, pos)
+    elif head in (b'{', b'['):
+        depth = 0
+        search = _SPECIAL.search
+        match = search(raw, pos)
+        while match is not None:  # 每个字节最多检查一次
+            char = match.group()
+            if char == b'"':
+                match = _STRING.match(raw, match.start())
+                if match is None:
+                    break
+            else:
+                depth += _DEPTH[char]
+                if not depth:
+                    return match.end()
+            match = search(raw, match.end())
+        raise ValueError('unterminated value at %s' % pos)
+    else:
+        match = _SCALAR.match(raw, pos)
+    if match is None:
+        raise ValueError('invalid value at %s' % pos)
+    return match.end()
+
+
+def _key(token):
+    if b'\\' in token:
+        return json.loads(token.decode('utf-8'))
+    return token[1:-1].decode('utf-8')
+
+
+def extract(raw, names):
+    """
+    从JSON object的bytes中取出names中的顶层key, 不是object时抛出ValueError;
+    重复的key与json.loads相同, 取最后一个
+    """
+    wanted = set(names)
+    found = {}
+    pos = _WS.match(raw, 0).end()
+    if raw[pos:pos + 1] != b'{':
+        raise ValueError('not a JSON object')
+    pos = _WS.match(raw, pos + 1).end()
+    if raw[pos:pos + 1] == b'}' or not wanted:
+        return found
+    while True:
+        match = _STRING.match(raw, pos)
+        if match is None:
+            raise ValueError('invalid key at %s' % pos)
+        key = _key(match.group())
+        pos = _WS.match(raw, match.end()).end()
+        if raw[pos:pos + 1] != b':':
+            raise ValueError('expect ":" at %s' % pos)
+        pos = _WS.match(raw, pos + 1).end()
+        end = _skip(raw, pos)
+        if key in wanted:
+            found[key] = json.loads(raw[pos:end].decode('utf-8'))
+        pos = _WS.match(raw, end).end()
+        sep = raw[pos:pos + 1]
+        if sep == b'}':
+            return found
+        if sep != b',':
+            raise ValueError('expect "," at %s' % pos)
+        pos = _WS.match(raw, pos + 1).end()
+
+
+def _raw_body(request):
+    """
+    与HttpRequest.body相同, 整个body读入内存后放回_stream, 之后仍可以解析request.data;
+    与DRF解析JSON时一样不受DATA_UPLOAD_MAX_MEMORY_SIZE限制
+    """
+    from django.http.request import RawPostDataException
+    http = getattr(request, '_request', request)
+    if not hasattr(http, '_body'):
+        if http._read_started:  # request.data已解析时不能再读body
+            raise RawPostDataException()
+        http._body = http.read()
+        http._stream = BytesIO(http._body)
+    return http._body
+
+
+def stream_data_method(request, names=()):
+    """先取querystring, 再从JSON body中取其余的key"""
+    query = request.GET
+    data = {x: query[x] for x in names if x in query}
+    rest = [x for x in names if x not in data]
+    if not rest:
+        return data
+    if 'json' not in (request.content_type or ''):
+        body = request.data
+    else:
+        from django.http.request import RawPostDataException
+        try:
+            body = extract(_raw_body(request), rest)
+        except (RawPostDataException, ValueError, UnicodeDecodeError):
+            body = request.data
+    if not isinstance(body, dict) and hasattr(body, 'keys'):
+        body = {x: body[x] for x in rest if x in body}  # QueryDict等
+    if not isinstance(body, dict):
+        return body  # 批量模式的list
+    data.update((x, body[x]) for x in rest if x in body)
+    return data
+
+
+stream_data_method.wants_names = True  # para_ok_or_400传入itemset中的参数名
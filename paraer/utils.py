@@ -1,4 +1,7 @@
 from __future__ import unicode_literals
+import json
+import os
+from hashlib import sha1
 try:
     import markdown
     has_markdown = True
@@ -6,26 +9,67 @@ except ImportError:
     print('please install markdown')
     print('pip instlal markdown')
     has_markdown = False
-from .doc import SchemaGenerator
+from six.moves.urllib.parse import urlencode
+from openapi_codec.encode import _get_links
+from rest_framework.schemas import SchemaGenerator
+
+from . import doc  # noqa 导入时patch
 
 
 def doc_creator(title='',
                 url=None,
                 patterns=None,
                 urlconf=None,
-                querystring=''):
+                querystring='',
+                path='APIdoc.md',
+                incremental=False):
+    """
+    生成markdown文档, incremental为True时在path.manifest中记录每个接口的指纹,
+    下次生成时没有变化的接口直接复用上次的markdown; 默认不生成manifest
+    """
     from django.test import RequestFactory
-    from rest_framework import compat
     request = RequestFactory()
-    request = request.request(QUERY_STRING=compat.urlparse.urlencode(querystring))
+    request = request.request(QUERY_STRING=urlencode(querystring or {}))
     schema = SchemaGenerator(
-        title=title, url=url, patterns=patterns, urlconfi=urlconf).get_schema(
-            request=request)
-    MarkdownDocFactory(schema.content, request=request, title=title)
+        title=title, url=url, patterns=patterns, urlconf=urlconf).get_schema(
+            request=None, public=True)  # request只用于filter/no的过滤
+    links = [x[1] for x in _get_links(schema)]
+    manifest = incremental and Manifest('%s.manifest' % path) or None
+    return MarkdownDocFactory(
+        links, request=request, title=title,
+        manifest=manifest).create_file(path)
+
+
+class Manifest(object):
+    """接口指纹 -> 上次生成的markdown, 全量生成时只保留本次用到的接口"""
+
+    def __init__(self, path):
+        self.path = path
+        self.previous = {}
+        self.sections = {}
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.previous = json.loads(f.read().decode('utf-8'))
+
+    def get(self, key):
+        section = self.previous.get(key)
+        if section is not None:
+            self.sections[key] = section
+        return section
+
+    def set(self, key, section):
+        self.sections[key] = section
+
+    def save(self, prune=True):
+        sections = self.sections
+        if not prune:  # 用filter/no只生成了部分接口时, 保留其他接口的记录
+            sections = dict(self.previous, **sections)
+        with open(self.path, 'wb') as f:
+            f.write(json.dumps(sections, sort_keys=True).encode('utf-8'))
 
 
 class MarkdownDocFactory(object):
-    def __init__(self, links, request, title):
+    def __init__(self, links, request, title, manifest=None):
         self.field_string = '|{field}|{dec}|{param_type}|{paramter_type}|{required}|\n'
         self.request = request
         self.title = title
@@ -38,47 +82,111 @@ class MarkdownDocFactory(object):
 |:--:|:--:|:------:|:------:|:------:|
 '''
         self.links = links
+        self._descriptions = {}  # 相同的描述(如枚举表)只渲染一次
+        self.manifest = manifest
+        self.reused = self.rendered = 0
+        self.filtered = False
+        self._template = sha1(
+            (self.url_md_template + self.field_string).encode('utf-8')
+        ).hexdigest()  # 模板变化时所有的指纹都变化
 
-    def _create_url_md(self):
-        url_md_list = []
+    def _fingerprint(self, link):
+        fields = [(x.name, x.description, x.type, x.location, x.required)
+                  for x in link.fields]
+        data = [
+            self._template, link.url, link.action, link.description, fields
+        ]
+        return sha1(json.dumps(data, default=str).encode('utf-8')).hexdigest()
+
+    def _render_description(self, description):
+        dec = self._descriptions.get(description)
+        if dec is None:
+            dec = markdown.markdown(
+                description, extensions=['markdown.extensions.tables'])
+            dec = self._descriptions[description] = "".join(dec.split())
+        return dec
+
+    def _filter_links(self):
+        links = self.links
         filter = self.request.GET.get('filter')
         if filter:
-            self.links = [x for x in self.links if filter in x.url]
+            links = [x for x in links if filter in x.url]
         no = self.request.GET.get('no')
         if no:
-            self.links = [x for x in self.links if no not in x.url]
-        for link in self.links:
+            links = [x for x in links if no not in x.url]
+        self.filtered = bool(filter or no)
+        return links
+
+    def _render_link(self, link):
+        try:
+            description = link.description.decode('utf-8')
+        except Exception:
+            description = link.description
+        parts = [
+            self.url_md_template.format(
+                url=link.url, action=link.action, description=description)
+        ]
+        parts.extend(
+            self.field_string.format(
+                field=field.name,
+                dec=self._render_description(field.description or ''),
+                param_type=field.type,
+                paramter_type=field.location,
+                required='是' if field.required else '否')
+            for field in link.fields)
+        return ''.join(parts)
+
+    def _section(self, link):
+        if self.manifest is None:
+            self.rendered += 1
+            return self._render_link(link)
+        key = self._fingerprint(link)
+        section = self.manifest.get(key)
+        if section is None:
+            self.rendered += 1
+            section = self._render_link(link)
+            self.manifest.set(key, section)
+        else:
+            self.reused += 1
+        return section
+
+    def iter_url_md(self):
+        """逐个生成每个接口的markdown"""
+        for link in self._filter_links():
             if link.fields:
-                try:
-                    description = link.description.decode('utf-8')
-                except Exception:
-                    print(description)
-                    description = link.description
-
-                url_title = self.url_md_template.format(
-                    url=link.url, action=link.action, description=description)
-                for field in link.fields:
-                    dec = markdown.markdown(
-                        field.description,
-                        extensions=['markdown.extensions.tables'])
-                    dec_no_enter = "".join(dec.split())
-                    field_str = self.field_string.format(
-                        field=field.name,
-                        dec=dec_no_enter,
-                        param_type=field.type,
-                        paramter_type=field.location,
-                        required='是' if field.required else '否')
-                    url_title += field_str
-                url_md_list.append(url_title)
-        return url_md_list
-
-    def create(self, title):
+                yield self._section(link)
+
+    def _create_url_md(self):
+        return list(self.iter_url_md())
+
+    def write(self, fp):
+        """边生成边写入fp(以二进制方式打开的文件)"""
+        fp.write(self.title.encode('utf-8'))
+        for section in self.iter_url_md():
+            fp.write(section.encode('utf-8'))
+
+    def render(self):
+        return ''.join([self.title] + self._create_url_md())
+
+    def _save_manifest(self):
+        self.manifest is not None and self.manifest.save(
+            prune=not self.filtered)
+
+    def create(self, title=None, path='APIdoc.md'):
+        """写入path并返回markdown文本"""
+        if not has_markdown:
+            return
+        md = self.render()
+        with open(path, 'wb') as f:
+            f.write(md.encode('utf-8'))
+        self._save_manifest()
+        return md
+
+    def create_file(self, path='APIdoc.md'):
+        """边生成边写入path, 不在内存中拼接整个文档, 返回path"""
         if not has_markdown:
             return
-        url_md_list = self._create_url_md()
-        swager_md = self.title
-        md = ''.join(url_md_list)
-        swager_md += md
-        with open('APIdoc.md', 'wb') as f:
-            f.write(swager_md.encode('utf-8'))
-        return swager_md
+        with open(path, 'wb') as f:
+            self.write(f)
+        self._save_manifest()
+        return path
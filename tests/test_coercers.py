@@ -0,0 +1,21 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+import unittest
+
+from paraer.coercers import to_integer
+
+
+class ToIntegerTest(unittest.TestCase):
+    def test_accepted(self):
+        for value, expected in ((1, 1), (1.0, 1), ('12', 12), ('-3', -3),
+                                ('+4', 4)):
+            self.assertEqual(to_integer(value), expected)
+
+    def test_rejected(self):
+        for value in (True, 1.7, float('inf'), '٣', ' 1', '1_000', '1.0',
+                      '', None):
+            self.assertIsNone(to_integer(value), value)
+
+
+if __name__ == '__main__':
+    unittest.main()
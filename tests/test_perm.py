@@ -0,0 +1,83 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+import unittest
+import warnings
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(
+        SECRET_KEY='test',
+        ALLOWED_HOSTS=['*'],
+        INSTALLED_APPS=[
+            'django.contrib.contenttypes', 'django.contrib.auth',
+            'rest_framework'
+        ],
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': ':memory:'
+            }
+        },
+        REST_FRAMEWORK={'UNAUTHENTICATED_USER': None})
+    import django
+    django.setup()
+
+from django.test import RequestFactory  # noqa: E402
+from rest_framework.request import Request  # noqa: E402
+
+from paraer import Result, perm_ok_or_403  # noqa: E402
+
+
+class StatusResult(Result):
+    def response(self, status=200, serialize=False, **kwargs):
+        return status
+
+
+async def _async_allow(request, kwargs):
+    return True
+
+
+def _allow(request, kwargs):
+    return True
+
+
+def _view(itemset, **options):
+    def get(self, request, *args, **kwargs):
+        return 200
+
+    return type(str('PermView'), (object, ), dict(
+        get=perm_ok_or_403(itemset, **options)(get),
+        result_class=StatusResult))()
+
+
+class AsyncPermOnSyncViewTest(unittest.TestCase):
+    def setUp(self):
+        self.request = Request(RequestFactory().get('/'))
+
+    def test_async_method_rejected(self):
+        with self.assertRaises(TypeError):
+            _view([dict(method=_async_allow, reason='denied')])
+
+    def test_async_before_rejected(self):
+        with self.assertRaises(TypeError):
+            _view([dict(method=_allow, before=_async_allow, reason='denied')])
+
+    def test_awaitable_result_denied(self):
+        # 返回协程的普通函数在装饰时无法识别, 运行时视为不通过
+        method = lambda request, kwargs: _async_allow(request, kwargs)
+        for options in (dict(), dict(parallel=True)):
+            for item in (dict(), dict(key=lambda r, k: 1, ttl=60)):
+                view = _view([dict(item, method=method, reason='denied')],
+                             **options)
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore', RuntimeWarning)
+                    self.assertEqual(view.get(self.request), 403)
+
+    def test_sync_method_allowed(self):
+        view = _view([dict(method=_allow, reason='denied')])
+        self.assertEqual(view.get(self.request), 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+import json
+import time
+import unittest
+
+from paraer.stream import extract
+
+
+class ExtractTest(unittest.TestCase):
+    def test_same_as_json(self):
+        raw = (b'{"a": 1, "skip": {"x": ["]", "}", {"y": "\\\\\\""}]},'
+               b' "b": "\\u4e2d", "c": [1, 2]}')
+        self.assertEqual(
+            extract(raw, ['a', 'b', 'c', 'd']),
+            {x: y
+             for x, y in json.loads(raw.decode('utf-8')).items() if x != 'skip'})
+
+    def test_duplicate_key_last_wins(self):
+        raw = b'{"amount": 1, "amount": 999}'
+        self.assertEqual(extract(raw, ['amount']), json.loads(raw))
+
+    def test_unterminated_string_is_linear(self):
+        for body in (b'{"x": [' + b'a' * 5000 + b'"', b'{"x": {"' + b'a' * 5000,
+                     b'{"x": [' + b'"a", ' * 5000):
+            start = time.time()
+            with self.assertRaises(ValueError):
+                extract(body, ['y'])
+            self.assertLess(time.time() - start, 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
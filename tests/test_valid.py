@@ -0,0 +1,31 @@
+# encoding: utf-8
+from __future__ import unicode_literals
+import unittest
+
+from paraer.datastrctures import Valid, intern, plain, scope, unscope
+
+
+class ClassMsgValid(Valid):
+    msg = 'class msg'
+
+    def check(self, value):
+        self.msg = 'bad %s' % value
+        return False
+
+
+class ClassAttributeTest(unittest.TestCase):
+    def test_msg_stays_in_scope(self):
+        valid = intern(ClassMsgValid, 'check', {})
+        self.assertTrue(plain(valid))
+        self.assertIsNone(valid.msg)  # 与以前相同, __init__中的None覆盖类属性
+        token = scope()
+        try:
+            self.assertEqual(valid.run(valid.check, 1), (False, 200, 'bad 1'))
+        finally:
+            unscope(token)
+        self.assertIsNone(valid.msg)
+        self.assertNotIn('msg', valid.__dict__)
+
+
+if __name__ == '__main__':
+    unittest.main()